@@ -0,0 +1,31 @@
+import threading
+
+
+class BatchSizer:
+    """
+    Size of the next batch, adapted to the responses: grows while batches are answered fast and
+    stay well under max_bytes, shrinks on slow responses, and halves on timeouts and server errors
+    """
+
+    def __init__(self, size=100, min_size=1, max_size=1000, max_bytes=1024 * 1024, fast_seconds=2.0, slow_seconds=10.0):
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.fast_seconds = fast_seconds
+        self.slow_seconds = slow_seconds
+        self.lock = threading.Lock()
+
+    def success(self, count, seconds, payload_bytes):
+        with self.lock:
+            if seconds > self.slow_seconds:
+                self.size = max(self.min_size, int(self.size * 0.75))
+            elif seconds < self.fast_seconds and count >= self.size:
+                # only full batches tell whether a bigger one would do
+                per_item = payload_bytes / max(count, 1)
+                grown = min(self.max_size, int(self.size * 1.5) + 1, int(self.max_bytes / 2 / max(per_item, 1)))
+                self.size = max(self.size, grown)
+
+    def failure(self):
+        with self.lock:
+            self.size = max(self.min_size, self.size // 2)
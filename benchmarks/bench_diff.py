@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Micro-benchmark of diffing local items against a remote trakt collection, the string keys
+# and split() of the former filter_to_add against diff() with tuple keys, on synthetic items.
+#
+#   python benchmarks/bench_diff.py [-n 100000] [-r 3]
+#
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trakt.objects import Episode, Movie, Season, Show
+
+from csv_to_trakt import LocalItem, TraktItem, split
+from diff import diff
+
+
+def legacy_local_key(item):
+    media_type = item["media_type"]
+    if media_type in ["movie", "show"]:
+        return "{}-{}".format(media_type, item["trakt_id"])
+    elif media_type == "season":
+        return "season-{}-s{}".format(item["trakt_show_id"], item["season_number"])
+    raise Exception(f"Get key error: unknown media_type {media_type}")
+
+
+def legacy_remote_key(item):
+    if isinstance(item, Movie):
+        return "movie-{}".format(item.get_key("trakt"))
+    elif isinstance(item, dict) and item.get("type") == "movie":
+        return "movie-{}".format(item["movie"]["ids"]["trakt"])
+    elif isinstance(item, Show):
+        return "show-{}".format(item.get_key("trakt"))
+    elif isinstance(item, Season):
+        return "season-{}-s{}".format(item.show.get_key("trakt"), item.pk)
+    elif isinstance(item, dict) and item.get("type") == "season":
+        return "season-{}-s{}".format(item["show"]["ids"]["trakt"], item["season"]["number"])
+    elif isinstance(item, Episode):
+        return "episode-{}-s{}e{}".format(item.season.show.get_key("trakt"), item.pk[0], item.pk[1])
+    raise Exception(f"Get key error: unknown type {type(item)}")
+
+
+def legacy_typed_string(items):
+    total_cnt = len(items)
+    if total_cnt == 0:
+        return "0 items"
+    details = ""
+    for media_type in ["movie", "show", "season", "episode"]:
+        cnt = len(list(filter(lambda x: x["media_type"] == media_type, items)))
+        details = f"{details}, {cnt} {media_type}s" if cnt else details
+    return f"{total_cnt}({details[2:]}) items"
+
+
+def legacy_diff(items, remote_data):
+    valid, invalid = split(items, LocalItem.validate_id)
+    remote_dict = dict([(legacy_remote_key(x), x) for x in remote_data])
+    added, to_add = split(valid, lambda x: remote_dict.get(legacy_local_key(x)))
+    for x in [items, added, to_add]:
+        legacy_typed_string(x)
+    return to_add, added, invalid
+
+
+def current_diff(items, remote_data):
+    result = diff(items, remote_data, LocalItem.index_key, TraktItem.index_key, LocalItem.validate_id)
+    for x in [items, result.present, result.to_add]:
+        LocalItem.typed_string(x)
+    return result.to_add, result.present, result.invalid
+
+
+def synthetic(count):
+    """
+    count local items, 80% movies and 20% seasons, 1% without trakt id, and the remote collection
+    holding half of them plus as many items unknown locally
+    """
+    local, remote = [], []
+    show = None
+    for i in range(count):
+        if i % 5 == 4:
+            if i % 50 == 4:
+                show = Show(None, [("trakt", str(1000000 + i))])
+            item = {"media_type": "season", "trakt_id": str(i), "trakt_show_id": show.get_key("trakt"), "season_number": str(i % 50)}
+            media = Season(None, [i % 50])
+            media.show = show
+        else:
+            item = {"media_type": "movie", "trakt_id": str(i)}
+            media = Movie(None, [("trakt", str(i))])
+        if i % 100 == 99:
+            item["trakt_id"] = ""
+        local.append(item)
+        if i % 2 == 0:
+            remote.append(media)
+        if i % 4 == 1:
+            remote.append(Movie(None, [("trakt", str(count + i))]))
+    return local, remote
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark diffing local items against a remote collection")
+    parser.add_argument("-n", "--number", type=int, default=100000, help="local items")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per case, the best one is reported")
+    args = parser.parse_args()
+
+    local, remote = synthetic(args.number)
+    to_add, present, invalid = legacy_diff(local, remote)
+    result = current_diff(local, remote)
+    if [len(to_add), len(present), len(invalid)] != [len(x) for x in result]:
+        raise SystemExit(f"results differ: {len(to_add)}/{len(present)}/{len(invalid)} vs {'/'.join(str(len(x)) for x in result)}")
+    print(f"{len(local)} local, {len(remote)} remote: {len(to_add)} to add, {len(present)} present, {len(invalid)} invalid")
+
+    legacy_ms = min(timeit.repeat(lambda: legacy_diff(local, remote), number=1, repeat=args.repeat)) * 1000
+    current_ms = min(timeit.repeat(lambda: current_diff(local, remote), number=1, repeat=args.repeat)) * 1000
+    print(f"{'legacy':<10}{legacy_ms:>10.1f} ms")
+    print(f"{'diff':<10}{current_ms:>10.1f} ms{legacy_ms / current_ms:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
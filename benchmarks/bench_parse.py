@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Micro-benchmark of douban page parsing, the BeautifulSoup extraction used before
+# douban_parser against douban_parser, on the recorded pages in fixtures/douban.
+#
+#   python benchmarks/bench_parse.py [-n 50]
+#
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+
+import douban_parser
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "douban")
+
+
+def soup_items(text):
+    soup = BeautifulSoup(text, "lxml")
+    items = []
+    for dom_item in soup.find_all("div", {"class": "item"}):
+        rating = dom_item.find("span", {"class": "date"}).find_previous_siblings()
+        comment = dom_item.find("span", {"class": "comment"})
+        date = dom_item.find("span", {"class": "date"})
+        items.append(
+            {
+                "link": dom_item.a["href"],
+                "title": dom_item.find("li", {"class": "title"}).em.text,
+                "rating": int(rating[0]["class"][0][6]) if len(rating) > 0 else None,
+                "comment": comment.contents[0].strip() if comment else None,
+                "date": date.contents[0].strip() if date else None,
+            }
+        )
+    return items
+
+
+def soup_max(text):
+    soup = BeautifulSoup(text, "lxml")
+    paginator = soup.find("div", {"class": "paginator"})
+    max_page = paginator.find_all("a")[-2].get_text() if paginator else 1
+    subject_sum = soup.find("span", {"class": "subject-num"})
+    total_count = subject_sum.get_text().split("/")[1].strip() if subject_sum else 0
+    return int(max_page), int(total_count)
+
+
+def soup_imdb_id(text):
+    soup = BeautifulSoup(text, "lxml")
+    info_area = soup.find(id="info")
+    imdb_id = None
+    for index in range(-1, -len(info_area.find_all("span")) + 1, -1):
+        imdb_id = info_area.find_all("span")[index].next_sibling.strip()
+        if imdb_id.startswith("tt"):
+            break
+    return imdb_id
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark douban page parsing")
+    parser.add_argument("-n", "--number", type=int, default=50, help="parses per case")
+    args = parser.parse_args()
+
+    grid = read_fixture("grid.html")
+    subject = read_fixture("subject.html")
+    cases = [
+        ("grid items", grid, soup_items, douban_parser.parse_items),
+        ("grid max", grid, soup_max, douban_parser.parse_max),
+        ("subject imdb", subject, soup_imdb_id, douban_parser.parse_imdb_id),
+    ]
+
+    print(f"{'case':<14}{'size':>9}{'soup ms':>10}{'lxml ms':>10}{'speedup':>9}")
+    for name, text, baseline, current in cases:
+        if baseline(text) != current(text):
+            raise SystemExit(f"{name}: results differ\n  soup: {baseline(text)}\n  lxml: {current(text)}")
+        soup_ms = timeit.timeit(lambda: baseline(text), number=args.number) / args.number * 1000
+        lxml_ms = timeit.timeit(lambda: current(text), number=args.number) / args.number * 1000
+        print(f"{name:<14}{len(text) // 1024:>7}KB{soup_ms:>10.2f}{lxml_ms:>10.2f}{soup_ms / lxml_ms:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# End-to-end benchmark of douban_to_csv.scrape against the replay server of recorded pages in
+# fake_douban.py, full scans of synthetic profiles of 100 to 20k items with a cold page cache.
+# Every scrape runs in its own process and working directory, and reports the items per second,
+# the parse time per grid and subject page, and the peak memory of the scraper.
+#
+#   python benchmarks/bench_scrape.py [--sizes 100,1000,5000,20000] [--latency 0.005] [--workers 4] ...
+#
+import argparse
+import csv
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+
+def prepare(work_dir, base_url, args):
+    os.makedirs(os.path.join(work_dir, "output"), exist_ok=True)
+    with open(os.path.join(work_dir, "config.yaml"), "w") as f:
+        json.dump(
+            {
+                "douban": {
+                    "user_id": "bench",
+                    "cookies": "bid=bench",
+                    "requests_per_second": args.rate,
+                    "burst": args.workers * 2,
+                    "workers": args.workers,
+                    "max_retries": 3,
+                    "backoff_seconds": 1,
+                    "full_scan": True,
+                    "movie_url": base_url,
+                    "mobile_url": base_url,
+                }
+            },
+            f,
+        )
+
+
+class Timed:
+    """
+    Wrap a parser function, summing its calls and seconds
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+        self.seconds = 0.0
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.calls += 1
+
+    def per_call_ms(self):
+        return self.seconds / self.calls * 1000 if self.calls else 0.0
+
+
+def run_scrape(work_dir):
+    """
+    Child process: scrape in work_dir and print the measurements as json
+    """
+    from file import WorkingDir
+
+    WorkingDir.set(work_dir)
+
+    import douban_to_csv
+
+    # the parsers are called by name from douban_to_csv, wrapping them there times every page
+    parse_items = douban_to_csv.parse_items = Timed(douban_to_csv.parse_items)
+    parse_imdb_id = douban_to_csv.parse_imdb_id = Timed(douban_to_csv.parse_imdb_id)
+
+    config = douban_to_csv.init_config(WorkingDir.get("config.yaml"))
+    file_name = WorkingDir.get_output("douban.csv")
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    error = None
+    try:
+        name = douban_to_csv.check_user_exist(config["user_id"])
+        douban_to_csv.scrape(config["user_id"], name, file_name, True)
+    except SystemExit as e:
+        error = f"exit {e.code}"
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    items = []
+    if os.path.exists(file_name):
+        with open(file_name, "r", encoding="utf-8") as f:
+            items = list(csv.DictReader(f))
+    result = {
+        "wall": wall,
+        "cpu": cpu,
+        "items": len(items),
+        "imdb": len([x for x in items if x["imdb_id"]]),
+        "grid_ms": parse_items.per_call_ms(),
+        "subject_ms": parse_imdb_id.per_call_ms(),
+        "parse_seconds": parse_items.seconds + parse_imdb_id.seconds,
+        # kilobytes on linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "error": error,
+    }
+    print(json.dumps(result), file=sys.__stdout__, flush=True)
+
+
+def start_server(size, args):
+    command = [
+        sys.executable,
+        os.path.join(BENCHMARKS, "fake_douban.py"),
+        "--items",
+        str(size),
+        "--latency",
+        str(args.latency),
+        "--block-rate",
+        str(args.block_rate),
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith("Listening on "):
+        server.kill()
+        raise SystemExit(f"fake douban server failed to start: {line}")
+    return server, line.split()[-1]
+
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark douban_to_csv against a replay server of recorded douban pages")
+    parser.add_argument("--sizes", default="100,1000,5000,20000", help="items of the profiles, comma separated")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds added to every request")
+    parser.add_argument("--block-rate", type=float, default=0.0, help='ratio of requests answered with the "异常请求" page')
+    parser.add_argument("--rate", type=float, default=1000, help="requests_per_second of the scraper")
+    parser.add_argument("--workers", type=int, default=4, help="workers of the scraper")
+    parser.add_argument("--keep", action="store_true", help="keep the working directories with the logs")
+    parser.add_argument("--run", metavar="DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_scrape(args.run)
+        return
+
+    rows = []
+    for size in [int(x) for x in args.sizes.split(",")]:
+        server, base_url = start_server(size, args)
+        work_dir = tempfile.mkdtemp(prefix=f"bench-scrape-{size}-")
+        try:
+            prepare(work_dir, base_url, args)
+            with open(os.path.join(work_dir, "run.log"), "w") as log:
+                child = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--run", work_dir], stdout=subprocess.PIPE, stderr=log, stdin=subprocess.DEVNULL, text=True
+                )
+            lines = child.stdout.strip().splitlines()
+            if child.returncode != 0 or not lines:
+                raise SystemExit(f"scrape of {size} items failed, see {work_dir}/run.log")
+            result = json.loads(lines[-1])
+            result["size"] = size
+            result["stats"] = get_json(f"{base_url}/_bench/stats")
+            rows.append(result)
+        finally:
+            server.terminate()
+            server.wait()
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            else:
+                print(f"log: {work_dir}/run.log")
+
+    print(f"{'items':>8}{'wall s':>9}{'cpu s':>9}{'items/s':>9}{'grid ms':>9}{'subj ms':>9}{'parse %':>9}{'rss MB':>8}  requests")
+    for row in rows:
+        requests = ", ".join("{} {}".format(kind, "/".join(f"{v}({k})" for k, v in sorted(counts.items()))) for kind, counts in sorted(row["stats"].items()))
+        print(
+            f"{row['size']:>8}{row['wall']:>9.2f}{row['cpu']:>9.2f}{row['items'] / row['wall']:>9.1f}{row['grid_ms']:>9.2f}{row['subject_ms']:>9.2f}"
+            f"{row['parse_seconds'] / row['cpu'] * 100 if row['cpu'] else 0:>8.1f}%{row['max_rss_mb']:>8.1f}  {requests}"
+            + (f"  ({row['error']})" if row["error"] else "")
+            + ("" if row["items"] == row["size"] else f"  (scraped {row['items']} of {row['size']})")
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Startup time of the commands, each run in a fresh interpreter as cron or a frozen build would,
+# and the heavy modules each of them imports. douban_to_trakt.py imports them lazily, the
+# legacy scripts douban_to_csv.py and csv_to_trakt.py at module load.
+#
+#   python benchmarks/bench_startup.py [-n 10]
+#
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["requests", "lxml", "bs4", "trakt", "tqdm", "yaml", "colorlog"]
+
+CASES = [
+    ("python -c pass", []),
+    ("douban_to_trakt.py --help", ["douban_to_trakt.py", "--help"]),
+    ("douban_to_trakt.py status", ["douban_to_trakt.py", "status"]),
+    ("douban_to_csv.py --help", ["douban_to_csv.py", "--help"]),
+    ("csv_to_trakt.py --help", ["csv_to_trakt.py", "--help"]),
+]
+
+# runs a script like "python script args", then reports the heavy modules it imported
+PROBE = """
+import json, runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps(sorted(x for x in {} if x in sys.modules)), file=sys.__stderr__)
+"""
+
+
+def run(argv):
+    command = [sys.executable] + (argv or ["-c", "pass"])
+    start = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def heavy_modules(argv):
+    if not argv:
+        return []
+    child = subprocess.run(
+        [sys.executable, "-c", PROBE.format(HEAVY)] + argv, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    lines = child.stderr.strip().splitlines()
+    return json.loads(lines[-1]) if lines else ["?"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the commands")
+    parser.add_argument("-n", "--number", type=int, default=10, help="runs per command")
+    args = parser.parse_args()
+
+    print(f"{'command':<30}{'min ms':>9}{'median ms':>11}  heavy imports")
+    for name, argv in CASES:
+        times = [run(argv) * 1000 for _ in range(args.number)]
+        print(f"{name:<30}{min(times):>9.0f}{statistics.median(times):>11.0f}  {', '.join(heavy_modules(argv)) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
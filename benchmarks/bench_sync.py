@@ -0,0 +1,185 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# End-to-end benchmark of csv_to_trakt.Client.run against the local stand-in of the trakt api
+# in fake_trakt.py, importing synthetic csv files of 1k/10k/50k items into an empty account.
+# Every import runs in its own process and working directory, and reports the wall time,
+# the cpu time of the importer, the time slept by the rate limiter and the requests per endpoint.
+#
+#   python benchmarks/bench_sync.py [--sizes 1000,10000,50000] [--latency 0.005] [--error-rate 0.01] ...
+#
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+
+def write_csv(file_name, count):
+    """
+    count items with imdb ids tt0000001.., 70% "collect" and 30% "wish", ratings on 80% and
+    comments on 30% of "collect"
+    """
+    with open(file_name, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, ["douban_id", "type", "title", "rating", "comment", "date", "imdb_id"])
+        writer.writeheader()
+        for i in range(1, count + 1):
+            collect = i % 10 < 7
+            writer.writerow(
+                {
+                    "douban_id": str(1000000 + i),
+                    "type": "collect" if collect else "wish",
+                    "title": f"Title {i}",
+                    "rating": str(i % 5 + 1) if collect and i % 5 != 0 else "",
+                    "comment": f"Comment number {i} of the benchmark" if collect and i % 10 < 3 else "",
+                    "date": "20{:02d}-{:02d}-{:02d}".format(i % 20 + 3, i % 12 + 1, i % 28 + 1),
+                    "imdb_id": f"tt{i:07d}",
+                }
+            )
+
+
+def prepare(work_dir, count, base_url, verify):
+    os.makedirs(os.path.join(work_dir, "output"), exist_ok=True)
+    write_csv(os.path.join(work_dir, "output", "douban.csv"), count)
+    with open(os.path.join(work_dir, "config.yaml"), "w") as f:
+        json.dump(
+            {"trakt": {"client_id": "bench", "client_secret": "bench", "redirect_uri": "urn:ietf:wg:oauth:2.0:oob", "base_url": base_url, "verify": verify}},
+            f,
+        )
+    with open(os.path.join(work_dir, ".trakt_auth"), "w") as f:
+        json.dump(
+            {"access_token": "bench", "refresh_token": "bench", "token_type": "bearer", "scope": "public", "created_at": int(time.time()), "expires_in": 7776000},
+            f,
+        )
+
+
+def run_import(work_dir):
+    """
+    Child process: run the import in work_dir and print the measurements as json
+    """
+    from file import WorkingDir
+
+    WorkingDir.set(work_dir)
+
+    from csv_to_trakt import Client
+    from http_client import http
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    error = None
+    try:
+        Client().run()
+    except SystemExit as e:
+        error = f"exit {e.code}"
+    result = {
+        "wall": time.perf_counter() - wall,
+        "cpu": time.process_time() - cpu,
+        "throttle_sleep": sum(getattr(x, "slept", 0.0) for x in http.throttles.values()),
+        "connections": sum(x["connections"] for x in http.stats().values()),
+        "error": error,
+    }
+    print(json.dumps(result), file=sys.__stdout__, flush=True)
+
+
+def start_server(args):
+    command = [
+        sys.executable,
+        os.path.join(BENCHMARKS, "fake_trakt.py"),
+        "--latency",
+        str(args.latency),
+        "--jitter",
+        str(args.jitter),
+        "--error-rate",
+        str(args.error_rate),
+        "--get-limit",
+        str(args.get_limit),
+        "--post-limit",
+        str(args.post_limit),
+        "--period",
+        str(args.period),
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith("Listening on "):
+        server.kill()
+        raise SystemExit(f"fake trakt server failed to start: {line}")
+    return server, line.split()[-1]
+
+
+def get_json(url):
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark csv_to_trakt against a local stand-in of the trakt api")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="items of the csv files, comma separated")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.005, help="random seconds added on top of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="ratio of requests answered with 503")
+    parser.add_argument("--get-limit", type=int, default=100000, help="GET requests per period")
+    parser.add_argument("--post-limit", type=int, default=100000, help="POST/DELETE requests per period")
+    parser.add_argument("--period", type=int, default=10, help="seconds of a rate limit period")
+    parser.add_argument("--verify", choices=["optimistic", "full"], default="optimistic")
+    parser.add_argument("--keep", action="store_true", help="keep the working directories with the logs")
+    parser.add_argument("--run", metavar="DIR", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_import(args.run)
+        return
+
+    rows = []
+    for size in [int(x) for x in args.sizes.split(",")]:
+        server, base_url = start_server(args)
+        work_dir = tempfile.mkdtemp(prefix=f"bench-sync-{size}-")
+        try:
+            prepare(work_dir, size, base_url, args.verify)
+            with open(os.path.join(work_dir, "run.log"), "w") as log:
+                child = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--run", work_dir], stdout=subprocess.PIPE, stderr=log, stdin=subprocess.DEVNULL, text=True
+                )
+            lines = child.stdout.strip().splitlines()
+            if child.returncode != 0 or not lines:
+                raise SystemExit(f"import of {size} items failed, see {work_dir}/run.log")
+            result = json.loads(lines[-1])
+            result["size"] = size
+            result["stats"] = get_json(f"{base_url}/_bench/stats")
+            rows.append(result)
+        finally:
+            server.terminate()
+            server.wait()
+            if not args.keep:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            else:
+                print(f"log: {work_dir}/run.log")
+
+    print(f"{'items':>8}{'wall s':>9}{'cpu s':>9}{'sleep s':>9}{'requests':>10}{'conns':>7}  status")
+    for row in rows:
+        statuses = {}
+        for counts in row["stats"].values():
+            for status, count in counts.items():
+                statuses[status] = statuses.get(status, 0) + count
+        requests = sum(statuses.values())
+        print(
+            f"{row['size']:>8}{row['wall']:>9.2f}{row['cpu']:>9.2f}{row['throttle_sleep']:>9.2f}{requests:>10}{row['connections']:>7}  "
+            + ", ".join(f"{k}: {v}" for k, v in sorted(statuses.items()))
+            + (f"  ({row['error']})" if row["error"] else "")
+        )
+    for row in rows:
+        print(f"\n{row['size']} items, requests per endpoint:")
+        for endpoint, counts in sorted(row["stats"].items()):
+            print(f"  {endpoint:<45}{sum(counts.values()):>8}")
+
+
+if __name__ == "__main__":
+    main()
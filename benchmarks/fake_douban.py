@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Local replay server of douban pages for benchmarks, serving a synthetic profile built from
+# the recorded pages in fixtures/douban: grid pages of "collect" and "wish" with a generated
+# paginator, subject pages with distinct imdb ids, the mobile user page, and the "异常请求"
+# page answered with 403 for a ratio of the requests. Every 53rd subject has no imdb id.
+#
+#   python benchmarks/fake_douban.py --items 1000 [--port 0] [--latency 0.005] [--block-rate 0.01]
+#
+# Prints "Listening on http://127.0.0.1:<port>" once ready, point movie_url and mobile_url of
+# the douban config at it. GET /_bench/stats returns the requests per page kind and status.
+#
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "douban")
+PAGE_SIZE = 15
+SUBJECT_OFFSET = 2000000
+RECORDED_IMDB = "tt0111161"
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+class GridTemplate:
+    """
+    Recorded grid page split into the head, the item blocks and the tail with the paginator
+    """
+
+    def __init__(self, text):
+        starts = [x.start() for x in re.finditer(r'<div class="item comment-item"', text)]
+        paginator = text.index('<div class="paginator">')
+        end = text.rindex("</div>", 0, paginator)
+        self.head = text[: starts[0]]
+        self.tail = text[end:]
+        self.items = [text[a:b] for a, b in zip(starts, starts[1:] + [end])]
+
+    def render(self, user_id, collect_type, start, subject_ids, total):
+        head = re.sub(r"\d+-\d+&nbsp;/&nbsp;\d+", f"{start + 1}-{start + len(subject_ids)}&nbsp;/&nbsp;{total}", self.head)
+        # recorded items are reused round robin, so ratings, comments and missing fields keep their mix
+        items = [
+            re.sub(r"/subject/\d+/", f"/subject/{x}/", self.items[(start + i) % len(self.items)])
+            for i, x in enumerate(subject_ids)
+        ]
+        tail = re.sub(r'<div class="paginator">.*?</div>', self._paginator(user_id, collect_type, start, total), self.tail, count=1, flags=re.S)
+        return head + "".join(items) + tail
+
+    @staticmethod
+    def _paginator(user_id, collect_type, start, total):
+        pages = math.ceil(total / PAGE_SIZE)
+        if pages <= 1:
+            return '<div class="paginator"></div>'
+        current = start // PAGE_SIZE + 1
+
+        def link(page, text=None):
+            href = f"/people/{user_id}/{collect_type}?start={(page - 1) * PAGE_SIZE}&amp;sort=time&amp;rating=all&amp;filter=all&amp;mode=grid"
+            return f'<a href="{href}">{text or page}</a>'
+
+        parts = ['<div class="paginator">']
+        parts.append(f'<span class="prev">{link(current - 1, "&lt;前页")}</span>' if current > 1 else '<span class="prev">&lt;前页</span>')
+        shown = sorted(set(x for x in [1, 2, 3, current - 1, current, current + 1, pages] if 1 <= x <= pages))
+        previous = 0
+        for page in shown:
+            if page > previous + 1:
+                parts.append('<span class="break">...</span>')
+            parts.append(f'<span class="thispage">{page}</span>' if page == current else link(page))
+            previous = page
+        parts.append(f'<span class="next">{link(current + 1, "后页&gt;")}</span>' if current < pages else '<span class="next">后页&gt;</span>')
+        parts.append(f'<span class="count">(共{total}个)</span>')
+        parts.append("</div>")
+        return "\n".join(parts)
+
+
+class FakeDouban:
+    def __init__(self, items=1000, wish_ratio=0.3, latency=0.0, block_rate=0.0, seed=0):
+        self.grid = GridTemplate(read_fixture("grid.html"))
+        self.subject = read_fixture("subject.html")
+        self.user = read_fixture("user.html")
+        self.blocked = read_fixture("blocked.html")
+        self.base_url = None
+
+        wish = int(items * wish_ratio)
+        ids = [SUBJECT_OFFSET + x for x in range(1, items + 1)]
+        self.subjects = {"collect": ids[: items - wish], "wish": ids[items - wish :]}
+        self.latency = latency
+        self.block_rate = block_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def handle(self, url):
+        """
+        Return (status, content type, text)
+        """
+        parts = urlsplit(url)
+        path = parts.path.strip("/")
+        query = dict((k, v[0]) for k, v in parse_qs(parts.query).items())
+        if path.startswith("_bench/"):
+            return self._bench(path)
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            blocked = self.random.random() < self.block_rate
+        if blocked:
+            status, text = 403, self.blocked
+        else:
+            status, text = self._route(path.split("/"), query)
+        self._count(path, status)
+        # absolute links of the recorded pages point back to this server
+        return status, "text/html; charset=utf-8", text.replace("https://movie.douban.com", self.base_url)
+
+    def _route(self, parts, query):
+        if len(parts) == 2 and parts[0] == "people":
+            return 200, self.user
+        if len(parts) == 3 and parts[0] == "people" and parts[2] in self.subjects:
+            subjects = self.subjects[parts[2]]
+            start = int(query.get("start", 0))
+            return 200, self.grid.render(parts[1], parts[2], start, subjects[start : start + PAGE_SIZE], len(subjects))
+        if len(parts) == 2 and parts[0] == "subject" and parts[1].isdigit():
+            number = int(parts[1]) - SUBJECT_OFFSET
+            if number % 53 == 0:
+                return 200, re.sub(r'<span class="pl">IMDb:</span>\s*tt\d+<br>', "", self.subject)
+            return 200, self.subject.replace(RECORDED_IMDB, f"tt{number:07d}")
+        return 404, "<html><head><title>404</title></head><body>404</body></html>"
+
+    def _count(self, path, status):
+        parts = path.split("/")
+        if parts[0] == "subject":
+            kind = "subject"
+        elif parts[0] == "people":
+            kind = "grid" if len(parts) == 3 else "user"
+        else:
+            kind = "other"
+        with self.lock:
+            counts = self.stats.setdefault(kind, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def _bench(self, path):
+        if path == "_bench/stats":
+            with self.lock:
+                return 200, "application/json", json.dumps(self.stats)
+        if path == "_bench/reset":
+            with self.lock:
+                self.stats = {}
+            return 200, "application/json", "{}"
+        return 404, "application/json", "{}"
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        status, content_type, text = self.server.douban.handle(self.path)
+        content = text.encode("utf-8")
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzipped:
+            content = gzip.compress(content, compresslevel=5)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(douban, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.douban = douban
+    douban.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local replay server of recorded douban pages")
+    parser.add_argument("--items", type=int, default=1000, help="items of the synthetic profile")
+    parser.add_argument("--wish-ratio", type=float, default=0.3, help="ratio of the items in wish")
+    parser.add_argument("--port", type=int, default=0, help="0 for any free port")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--block-rate", type=float, default=0.0, help='ratio of requests answered with the "异常请求" page')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    douban = FakeDouban(args.items, args.wish_ratio, args.latency, args.block_rate, args.seed)
+    server = serve(douban, args.port)
+    print(f"Listening on {douban.base_url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
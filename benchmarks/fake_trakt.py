@@ -0,0 +1,486 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Local stand-in of the trakt api for benchmarks, with the endpoints used by csv_to_trakt:
+# search, shows/*/seasons, sync/watchlist|history|ratings|watched, sync/last_activities,
+# users/settings, users/*/comments, comments and oauth/token. The catalog is derived from the imdb ids:
+# tt<n> is a movie with trakt id n, every 10th is a show with 3 seasons of 10 episodes,
+# and every 97th is unknown.
+#
+#   python benchmarks/fake_trakt.py [--port 0] [--latency 0.005] [--error-rate 0.01] ...
+#
+# Prints "Listening on http://127.0.0.1:<port>" once ready. GET /_bench/stats returns the
+# requests per endpoint and status.
+#
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SEASONS = 3
+EPISODES = 10
+
+
+def now_string(timestamp=None):
+    return datetime.fromtimestamp(timestamp or time.time(), timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class Catalog:
+    """
+    Media derived from ids, movie/show trakt id = imdb number, season id = show * 10 + number,
+    episode id = show * 1000 + season * 100 + number
+    """
+
+    @staticmethod
+    def imdb_number(imdb_id):
+        match = re.match(r"tt(\d+)$", imdb_id or "")
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def is_known(number):
+        return number is not None and number > 0 and number % 97 != 0
+
+    @classmethod
+    def is_show(cls, number):
+        return cls.is_known(number) and number % 10 == 0
+
+    @classmethod
+    def is_movie(cls, number):
+        return cls.is_known(number) and number % 10 != 0
+
+    @classmethod
+    def movie(cls, number):
+        return {"title": f"Movie {number}", "year": 2000 + number % 20, "ids": {"trakt": number, "slug": f"movie-{number}", "imdb": f"tt{number:07d}"}}
+
+    @classmethod
+    def show(cls, number):
+        return {"title": f"Show {number}", "year": 2000 + number % 20, "ids": {"trakt": number, "slug": f"show-{number}", "imdb": f"tt{number:07d}"}}
+
+    @classmethod
+    def season(cls, show, number, episodes=False):
+        season = {"number": number, "ids": {"trakt": show * 10 + number}}
+        if episodes:
+            season["episodes"] = [cls.episode(show, number, x) for x in range(1, EPISODES + 1)]
+        return season
+
+    @classmethod
+    def episode(cls, show, season, number):
+        return {"season": season, "number": number, "title": f"Episode {number}", "ids": {"trakt": show * 1000 + season * 100 + number}}
+
+    @classmethod
+    def season_of(cls, season_id):
+        show, number = divmod(int(season_id), 10)
+        return (show, number) if cls.is_show(show) and 1 <= number <= SEASONS else None
+
+
+class RateLimit:
+    def __init__(self, name, limit, period):
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.until = 0.0
+        self.remaining = limit
+
+    def take(self):
+        """
+        Return (allowed, header value, seconds until the period resets)
+        """
+        now = time.time()
+        if now >= self.until:
+            self.until = now + self.period
+            self.remaining = self.limit
+        allowed = self.remaining > 0
+        if allowed:
+            self.remaining -= 1
+        header = {
+            "name": self.name,
+            "period": self.period,
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "until": datetime.fromtimestamp(self.until, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        return allowed, json.dumps(header), max(1, int(self.until - now + 1))
+
+
+class FakeTrakt:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, get_limit=100000, post_limit=100000, period=10, max_limit=1000, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_limit = max_limit
+        self.random = random.Random(seed)
+        self.limits = {"GET": RateLimit("AUTHED_API_GET_LIMIT", get_limit, period), "POST": RateLimit("AUTHED_API_POST_LIMIT", post_limit, period)}
+
+        self.lock = threading.Lock()
+        # ("movie", id) / ("season", id) -> listed_at
+        self.watchlist = {}
+        # ("movie", id) / ("season", id) -> (rating, rated_at)
+        self.ratings = {}
+        # movie id / episode id -> [watched_at]
+        self.movie_plays = {}
+        self.episode_plays = {}
+        # comment id -> comment
+        self.comments = {}
+        self.next_comment_id = 1
+        self.activities = {}
+        self.stats = {}
+
+    def handle(self, method, url, body):
+        """
+        Return (status, headers, payload)
+        """
+        parts = urlsplit(url)
+        path = parts.path.strip("/")
+        query = dict((k, v[0]) for k, v in parse_qs(parts.query).items())
+        if path.startswith("_bench/"):
+            return self._bench(path)
+
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+        kind = "GET" if method in ["GET", "HEAD"] else "POST"
+        with self.lock:
+            allowed, rate_limit, retry_after = self.limits[kind].take()
+            error = self.random.random() < self.error_rate
+        headers = {"X-Ratelimit": rate_limit}
+        if not allowed:
+            status, payload = 429, {"error": "rate limit exceeded"}
+            headers["Retry-After"] = str(retry_after)
+        elif error:
+            status, payload = 503, {"error": "injected"}
+        else:
+            try:
+                status, payload, extra = self._route(method, path, query, json.loads(body) if body else None)
+                headers.update(extra)
+            except KeyError:
+                status, payload = 404, {"error": "not found"}
+        self._count(method, path, status)
+        return status, headers, payload
+
+    def _count(self, method, path, status):
+        # ids are replaced, so that the stats are per endpoint
+        endpoint = "{} {}".format(method, re.sub(r"/(tt)?\d+", "/*", path))
+        with self.lock:
+            counts = self.stats.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def _bench(self, path):
+        if path == "_bench/stats":
+            with self.lock:
+                return 200, {}, self.stats
+        if path == "_bench/reset":
+            with self.lock:
+                self.stats = {}
+            return 200, {}, {}
+        return 404, {}, {}
+
+    def _route(self, method, path, query, body):
+        parts = path.split("/")
+        if method == "GET" and parts[0] == "search":
+            return self._search(parts[1], parts[2])
+        if method == "GET" and parts[0] == "shows" and len(parts) >= 3 and parts[2] == "seasons":
+            show = int(parts[1])
+            if not Catalog.is_show(show):
+                raise KeyError(show)
+            return 200, [Catalog.season(show, x, "episodes" in query.get("extended", "")) for x in range(1, SEASONS + 1)], {}
+        if method == "POST" and path == "oauth/token":
+            token = {"access_token": "bench", "refresh_token": "bench", "token_type": "bearer", "scope": "public", "expires_in": 7776000}
+            token["created_at"] = int(time.time())
+            return 200, token, {}
+        if method == "GET" and path == "users/settings":
+            return 200, {"user": {"username": "bench", "ids": {"slug": "bench"}}}, {}
+        if method == "GET" and path == "sync/last_activities":
+            return 200, self._last_activities(), {}
+        if method == "GET" and parts[0] == "users" and len(parts) >= 3 and parts[2] == "comments":
+            return self._paginate(self._list_comments(), query)
+        if parts[0] == "comments":
+            if method == "POST":
+                return self._post_comment(body)
+            if method == "DELETE":
+                return self._delete_comment(int(parts[1]))
+        if parts[0] == "sync" and len(parts) >= 2:
+            collection = parts[1]
+            if method == "POST":
+                remove = len(parts) > 2 and parts[2] == "remove"
+                return 200, self._sync(collection, body or {}, remove), {}
+            if collection == "watchlist":
+                return self._paginate(self._list_watchlist(), query)
+            if collection == "ratings":
+                return self._paginate(self._list_ratings(), query)
+            if collection == "watched":
+                return 200, self._list_watched(parts[2] if len(parts) > 2 else "movies"), {}
+        raise KeyError(path)
+
+    def _paginate(self, items, query):
+        limit = min(int(query.get("limit") or 10), self.max_limit)
+        page = int(query.get("page") or 1)
+        page_count = max(1, (len(items) + limit - 1) // limit)
+        headers = {
+            "X-Pagination-Page": str(page),
+            "X-Pagination-Limit": str(limit),
+            "X-Pagination-Page-Count": str(page_count),
+            "X-Pagination-Item-Count": str(len(items)),
+        }
+        return 200, items[(page - 1) * limit : page * limit], headers
+
+    def _search(self, id_type, value):
+        number = Catalog.imdb_number(value) if id_type == "imdb" else None
+        if Catalog.is_show(number):
+            return 200, [{"type": "show", "score": None, "show": Catalog.show(number)}], {}
+        if Catalog.is_movie(number):
+            return 200, [{"type": "movie", "score": None, "movie": Catalog.movie(number)}], {}
+        return 200, [], {}
+
+    def _resolve(self, body):
+        """
+        Keys of the items of a sync/* body, and the items not found
+        """
+        keys, not_found = [], {"movies": [], "shows": [], "seasons": [], "episodes": []}
+        for entry in body.get("movies", []):
+            ids = entry.get("ids", {})
+            number = ids.get("trakt") or Catalog.imdb_number(ids.get("imdb"))
+            if Catalog.is_movie(int(number or 0)):
+                keys.append((("movie", int(number)), entry))
+            else:
+                not_found["movies"].append(entry)
+        for entry in body.get("seasons", []):
+            season = Catalog.season_of(entry.get("ids", {}).get("trakt") or 0)
+            if season:
+                keys.append((("season", season[0] * 10 + season[1]), entry))
+            else:
+                not_found["seasons"].append(entry)
+        for entry in body.get("shows", []):
+            show = int(entry.get("ids", {}).get("trakt") or 0)
+            if not Catalog.is_show(show):
+                not_found["shows"].append(entry)
+                continue
+            numbers = [x["number"] for x in entry.get("seasons", [])] or range(1, SEASONS + 1)
+            for number in numbers:
+                keys.append((("season", show * 10 + number), entry))
+        return keys, not_found
+
+    def _sync(self, collection, body, remove):
+        keys, not_found = self._resolve(body)
+        counts = {"movies": 0, "shows": 0, "seasons": 0, "episodes": 0}
+        existing = dict(counts)
+        now = now_string()
+        with self.lock:
+            for (media_type, media_id), entry in keys:
+                if collection == "history":
+                    plays = self.movie_plays if media_type == "movie" else self.episode_plays
+                    if media_type == "movie":
+                        ids = [media_id]
+                    else:
+                        show, number = divmod(media_id, 10)
+                        ids = [show * 1000 + number * 100 + x for x in range(1, EPISODES + 1)]
+                    for x in ids:
+                        if remove:
+                            if plays.pop(x, None):
+                                counts[f"{'movie' if media_type == 'movie' else 'episode'}s"] += 1
+                        else:
+                            plays.setdefault(x, []).append(entry.get("watched_at") or now)
+                            counts[f"{'movie' if media_type == 'movie' else 'episode'}s"] += 1
+                    continue
+
+                store = self.watchlist if collection == "watchlist" else self.ratings
+                key = (media_type, media_id)
+                if remove:
+                    if store.pop(key, None) is not None:
+                        counts[f"{media_type}s"] += 1
+                elif collection == "watchlist":
+                    if key in store:
+                        existing[f"{media_type}s"] += 1
+                    else:
+                        store[key] = now
+                        counts[f"{media_type}s"] += 1
+                else:
+                    store[key] = (entry.get("rating"), entry.get("rated_at") or now)
+                    counts[f"{media_type}s"] += 1
+            self.activities[collection] = now
+
+        result = {"deleted" if remove else "added": counts, "not_found": not_found}
+        if collection == "watchlist" and not remove:
+            result["existing"] = existing
+        return result
+
+    def _media(self, media_type, media_id):
+        if media_type == "movie":
+            return {"type": "movie", "movie": Catalog.movie(media_id)}
+        show, number = divmod(media_id, 10)
+        return {"type": "season", "season": Catalog.season(show, number), "show": Catalog.show(show)}
+
+    def _list_watchlist(self):
+        with self.lock:
+            items = list(self.watchlist.items())
+        result = []
+        for rank, ((media_type, media_id), listed_at) in enumerate(items, 1):
+            item = {"rank": rank, "id": rank, "listed_at": listed_at, "notes": None}
+            item.update(self._media(media_type, media_id))
+            result.append(item)
+        return result
+
+    def _list_ratings(self):
+        with self.lock:
+            items = list(self.ratings.items())
+        result = []
+        for (media_type, media_id), (rating, rated_at) in items:
+            item = {"rated_at": rated_at, "rating": rating}
+            item.update(self._media(media_type, media_id))
+            result.append(item)
+        return result
+
+    def _list_watched(self, media):
+        with self.lock:
+            movie_plays = dict((k, list(v)) for k, v in self.movie_plays.items())
+            episode_plays = dict((k, list(v)) for k, v in self.episode_plays.items())
+        if media == "movies":
+            return [
+                {"plays": len(v), "last_watched_at": max(v), "last_updated_at": max(v), "movie": Catalog.movie(k)} for k, v in movie_plays.items()
+            ]
+        shows = {}
+        for episode_id, plays in episode_plays.items():
+            show, rest = divmod(episode_id, 1000)
+            season, number = divmod(rest, 100)
+            seasons = shows.setdefault(show, {})
+            seasons.setdefault(season, []).append({"number": number, "plays": len(plays), "last_watched_at": max(plays)})
+        result = []
+        for show, seasons in shows.items():
+            last = max(e["last_watched_at"] for x in seasons.values() for e in x)
+            result.append(
+                {
+                    "plays": sum(e["plays"] for x in seasons.values() for e in x),
+                    "last_watched_at": last,
+                    "last_updated_at": last,
+                    "reset_at": None,
+                    "show": Catalog.show(show),
+                    "seasons": [{"number": k, "episodes": sorted(v, key=lambda e: e["number"])} for k, v in sorted(seasons.items())],
+                }
+            )
+        return result
+
+    def _list_comments(self):
+        with self.lock:
+            comments = list(self.comments.values())
+        result = []
+        for comment in comments:
+            item = {"comment": dict((k, v) for k, v in comment.items() if k != "media")}
+            item.update(self._media(*comment["media"]))
+            result.append(item)
+        return result
+
+    def _post_comment(self, body):
+        body = body or {}
+        if "movie" in body:
+            number = body["movie"].get("ids", {}).get("trakt") or Catalog.imdb_number(body["movie"].get("ids", {}).get("imdb"))
+            media = ("movie", int(number)) if Catalog.is_movie(int(number or 0)) else None
+        elif "season" in body:
+            season = Catalog.season_of(body["season"].get("ids", {}).get("trakt") or 0)
+            media = ("season", season[0] * 10 + season[1]) if season else None
+        else:
+            media = None
+        if not media:
+            return 404, {"error": "not found"}, {}
+        with self.lock:
+            comment_id = self.next_comment_id
+            self.next_comment_id += 1
+            comment = {
+                "id": comment_id,
+                "comment": body.get("comment", ""),
+                "spoiler": bool(body.get("spoiler")),
+                "review": False,
+                "created_at": now_string(),
+                "user": {"username": "bench"},
+                "media": media,
+            }
+            self.comments[comment_id] = comment
+            self.activities["comments"] = comment["created_at"]
+        return 201, dict((k, v) for k, v in comment.items() if k != "media"), {}
+
+    def _delete_comment(self, comment_id):
+        with self.lock:
+            if self.comments.pop(comment_id, None) is None:
+                return 404, {"error": "not found"}, {}
+            self.activities["comments"] = now_string()
+        return 204, None, {}
+
+    def _last_activities(self):
+        with self.lock:
+            activities = dict(self.activities)
+        epoch = "2000-01-01T00:00:00.000Z"
+        fields = {
+            "watched_at": activities.get("history", epoch),
+            "rated_at": activities.get("ratings", epoch),
+            "watchlisted_at": activities.get("watchlist", epoch),
+            "commented_at": activities.get("comments", epoch),
+        }
+        result = dict((x, dict(fields)) for x in ["movies", "shows", "seasons", "episodes"])
+        result["all"] = max(fields.values())
+        return result
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+        status, headers, payload = self.server.trakt.handle(self.command, self.path, body)
+        content = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(trakt, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.trakt = trakt
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in of the trakt api")
+    parser.add_argument("--port", type=int, default=0, help="0 for any free port")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random seconds added on top of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="ratio of requests answered with 503")
+    parser.add_argument("--get-limit", type=int, default=100000, help="GET requests per period")
+    parser.add_argument("--post-limit", type=int, default=100000, help="POST/DELETE requests per period")
+    parser.add_argument("--period", type=int, default=10, help="seconds of a rate limit period")
+    parser.add_argument("--max-limit", type=int, default=1000, help="max items per page")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    trakt = FakeTrakt(args.latency, args.jitter, args.error_rate, args.get_limit, args.post_limit, args.period, args.max_limit, args.seed)
+    server = serve(trakt, args.port)
+    print(f"Listening on http://127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
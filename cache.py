@@ -0,0 +1,80 @@
+import gzip
+import os
+import re
+import threading
+import time
+
+from logger import logger
+
+
+class FileCache:
+    """
+    On-disk cache of text entries, one gzip file per key under directory.
+    Entries expire after ttl seconds, the least recently written ones are evicted above max_bytes.
+    """
+
+    def __init__(self, directory, ttl=None, max_bytes=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key, allow_expired=False):
+        path = self._path(key)
+        try:
+            if not allow_expired and self._expired(os.path.getmtime(path)):
+                return None
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError) as e:
+            logger.warning(f"Drop broken cache entry {path}, e: {e}")
+            self.remove(key)
+            return None
+
+    def put(self, key, text):
+        path = self._path(key)
+        # write to a temporary file first, readers never see a partial entry
+        temp = "{}.{}.tmp".format(path, threading.get_ident())
+        with gzip.open(temp, "wt", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp, path)
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """
+        Remove expired entries, then the oldest ones until the cache fits in max_bytes
+        """
+        with self.lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".gz"):
+                    stat = entry.stat()
+                    if self._expired(stat.st_mtime):
+                        os.remove(entry.path)
+                    else:
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(x[1] for x in entries)
+            removed = 0
+            if self.max_bytes and total > self.max_bytes:
+                for _, size, path in sorted(entries):
+                    if total <= self.max_bytes:
+                        break
+                    os.remove(path)
+                    total -= size
+                    removed += 1
+            logger.debug(f"Cache {self.directory}: {len(entries) - removed} entries, {total // 1024}KB")
+
+    def _expired(self, mtime):
+        return bool(self.ttl) and time.time() - mtime > self.ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{}.gz".format(re.sub(r"[^\w.-]", "_", str(key))))
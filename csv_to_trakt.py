@@ -5,23 +5,54 @@
 # License:  GNU General Public License version 3 or later; see LICENSE.txt
 # Website:  https://trakt.tv, https://github.com/xlfu-cc/douban-to-trakt.git
 #
+import argparse
 import csv
 from datetime import datetime, timedelta, timezone
 import json
 import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from collections import Counter
 from itertools import groupby
-import requests
-from tqdm import trange
+from tqdm import tqdm
 
+import requests
 import yaml
 from trakt import Trakt
-from trakt.core.pagination import PaginationIterator
+from trakt.core.exceptions import ClientError, RequestError, RequestFailedError, ServerError
+from trakt.mapper.summary import SummaryMapper
+from trakt.mapper.sync import SyncMapper
 from trakt.objects import Episode, Movie, Season, Show
 
+from batching import BatchSizer
+from cache import FileCache
+from diff import diff, index_by
 from file import WorkingDir
+from http_client import http
+from id_store import FIELDS as ID_FIELDS, IdStore
+from journal import Journal
 from logger import logger
+from metrics import metrics
+from pagination import iter_pages, page_count
+from phases import Phases
+from plan import Plan
+from profiler import Profiler
+from throttle import HeaderRateLimiter
+
+
+# timestamps of 'sync/last_activities' changed by each remote collection
+ACTIVITY_FIELDS = {
+    "watchlist": [(x, "watchlisted_at") for x in ["movies", "shows", "seasons", "episodes"]],
+    "watched": [(x, "watched_at") for x in ["movies", "episodes"]],
+    "ratings": [(x, "rated_at") for x in ["movies", "shows", "seasons", "episodes"]],
+    "comments": [(x, "commented_at") for x in ["movies", "shows", "seasons", "episodes"]],
+}
+
+# comments posted by this importer end with it, other comments are never removed
+COMMENT_SUFFIX = "imported from douban"
 
 
 def split(data_list, prediction):
@@ -46,6 +77,21 @@ class LocalItem:
         else:
             raise Exception(f"Get key error: unknown media_type {media_type}")
 
+    @classmethod
+    def index_key(cls, item):
+        """
+        Key of item as a tuple, equal to TraktItem.index_key of the same media
+        """
+        media_type = item["media_type"]
+        if media_type == "movie" or media_type == "show":
+            return (media_type, str(item["trakt_id"]))
+        elif media_type == "season":
+            return ("season", str(item["trakt_show_id"]), str(item["season_number"]))
+        elif media_type == "episode" and item.get("episode_number") is not None:
+            return ("episode", str(item["trakt_show_id"]), str(item["season_number"]), str(item["episode_number"]))
+        else:
+            raise Exception(f"Get key error: unknown media_type {media_type}")
+
     @classmethod
     def validate_id(cls, item):
         return bool(item.get("trakt_id"))
@@ -92,7 +138,7 @@ class LocalItem:
         return {
             item["media_type"]: cls.data_id(item),
             "spoiler": False,
-            "comment": "{}, watched at {}, imported from douban".format(item["comment"], item["date"]),
+            "comment": "{}, watched at {}, {}".format(item["comment"], item["date"], COMMENT_SUFFIX),
         }
 
     @classmethod
@@ -106,27 +152,47 @@ class LocalItem:
 
     @classmethod
     def typed_string(cls, items):
-        total_cnt = len(items)
-        if total_cnt == 0:
+        if not items:
             return "0 items"
-        else:
-            details = ""
-            for media_type in ["movie", "show", "season", "episode"]:
-                cnt = len(list(filter(lambda x: x["media_type"] == media_type, items)))
-                details = f"{details}, {cnt} {media_type}s" if cnt else details
-            return f"{total_cnt}({details[2:]}) items"
+        # one pass for logging, even for large lists
+        counts = Counter(x["media_type"] for x in items)
+        details = ", ".join(f"{counts[x]} {x}s" for x in ["movie", "show", "season", "episode"] if counts[x])
+        return f"{len(items)}({details}) items"
 
     @classmethod
-    def segment_data(cls, items, item_info, segment_size):
-        segment_data = []
+    def segment(cls, items, segment_size):
         sorted_items = sorted(items, key=lambda x: x["media_type"])
         # split by segment_size
-        segments = [sorted_items[i : i + segment_size] for i in range(0, len(sorted_items), segment_size)]
-        for segment in segments:
-            # group by type
-            grouped = [list(group) for _, group in groupby(segment, lambda x: x["media_type"])]
-            segment_data.append(dict([(f"{group[0]['media_type']}s", list(item_info(x) for x in group)) for group in grouped]))
-        return segment_data
+        return [sorted_items[i : i + segment_size] for i in range(0, len(sorted_items), segment_size)]
+
+    @classmethod
+    def segment_data(cls, items, item_info, segment_size):
+        return [cls.to_data(segment, item_info) for segment in cls.segment(items, segment_size)]
+
+    @classmethod
+    def to_data(cls, segment, item_info):
+        # group by type
+        grouped = [list(group) for _, group in groupby(segment, lambda x: x["media_type"])]
+        return dict([(f"{group[0]['media_type']}s", list(item_info(x) for x in group)) for group in grouped])
+
+    @classmethod
+    def filter_not_found(cls, items, response):
+        """
+        Items reported in "not_found" of a sync/* response, all items if the request failed
+        """
+        if not isinstance(response, dict):
+            return list(items)
+        not_found = set()
+        for media_type, entries in (response.get("not_found") or {}).items():
+            for entry in entries if isinstance(entries, list) else []:
+                for id_type, value in (entry.get("ids") or {}).items():
+                    not_found.add((media_type, id_type, str(value)))
+        return [x for x in items if (f"{x['media_type']}s",) + cls._id_pair(x) in not_found]
+
+    @classmethod
+    def _id_pair(cls, item):
+        id_type, value = next(iter(cls.data_id(item)["ids"].items()))
+        return id_type, str(value)
 
     @classmethod
     def to_string(cls, item):
@@ -154,15 +220,45 @@ class TraktItem:
             return "movie-{}".format(item["movie"]["ids"]["trakt"])
         elif isinstance(item, Show):
             return "show-{}".format(item.get_key("trakt"))
+        elif isinstance(item, dict) and item.get("type") == "show":
+            return "show-{}".format(item["show"]["ids"]["trakt"])
         elif isinstance(item, Season):
             return "season-{}-s{}".format(item.show.get_key("trakt"), item.pk)
         elif isinstance(item, dict) and item.get("type") == "season":
             return "season-{}-s{}".format(item["show"]["ids"]["trakt"], item["season"]["number"])
         elif isinstance(item, Episode):
             return "episode-{}-s{}e{}".format(item.season.show.get_key("trakt"), item.pk[0], item.pk[1])
+        elif isinstance(item, dict) and item.get("type") == "episode":
+            return "episode-{}-s{}e{}".format(item["show"]["ids"]["trakt"], item["episode"]["season"], item["episode"]["number"])
         else:
             raise Exception(f"Get key error: unknown type {type(item)}")
 
+    @classmethod
+    def index_key(cls, item):
+        """
+        Key of item as a tuple, equal to LocalItem.index_key of the same media.
+        None for raw items of other types, e.g. comments on lists
+        """
+        if isinstance(item, dict):
+            index_key = cls._raw_index_keys.get(item.get("type"))
+            return index_key(item) if index_key else None
+        return cls._index_keys[type(item)](item)
+
+    _index_keys = {
+        Movie: lambda x: ("movie", str(x.get_key("trakt"))),
+        Show: lambda x: ("show", str(x.get_key("trakt"))),
+        Season: lambda x: ("season", str(x.show.get_key("trakt")), str(x.pk)),
+        Episode: lambda x: ("episode", str(x.season.show.get_key("trakt")), str(x.pk[0]), str(x.pk[1])),
+    }
+
+    # raw items, e.g. comments
+    _raw_index_keys = {
+        "movie": lambda x: ("movie", str(x["movie"]["ids"]["trakt"])),
+        "show": lambda x: ("show", str(x["show"]["ids"]["trakt"])),
+        "season": lambda x: ("season", str(x["show"]["ids"]["trakt"]), str(x["season"]["number"])),
+        "episode": lambda x: ("episode", str(x["show"]["ids"]["trakt"]), str(x["episode"]["season"]), str(x["episode"]["number"])),
+    }
+
     @classmethod
     def get_trakt_id(cls, item):
         if isinstance(item, Movie) or isinstance(item, Show):
@@ -193,16 +289,27 @@ class TraktItem:
 
     @classmethod
     def segment_data(cls, items, segment_size):
-        segment_data = []
         sorted_items = sorted(items, key=lambda x: cls.type_name(x))
         # split by segment_size
         segments = [sorted_items[i : i + segment_size] for i in range(0, len(sorted_items), segment_size)]
-        for segment in segments:
-            # group by type
-            grouped = [list(group) for _, group in groupby(segment, lambda x: cls.type_name(x))]
-            # get ids
-            segment_data.append(dict([(cls.type_name(group[0]) + "s", list({"ids": x.to_dict()["ids"]} for x in group)) for group in grouped]))
-        return segment_data
+        return [cls.to_data(segment) for segment in segments]
+
+    @classmethod
+    def to_data(cls, segment):
+        # group by type
+        grouped = [list(group) for _, group in groupby(segment, lambda x: cls.type_name(x))]
+        # get ids
+        data = dict([(cls.type_name(group[0]) + "s", list({"ids": x.to_dict()["ids"]} for x in group)) for group in grouped])
+        if "seasons" in data:
+            # seasons flattened from watched shows have no ids, refer to them by show and number
+            seasons = [x for x in segment if isinstance(x, Season)]
+            data["seasons"] = [{"ids": x.to_dict()["ids"]} for x in seasons if x.to_dict()["ids"]]
+            no_ids = [{"ids": x.show.to_dict()["ids"], "seasons": [{"number": x.pk}]} for x in seasons if not x.to_dict()["ids"]]
+            if no_ids:
+                data["shows"] = data.get("shows", []) + no_ids
+            if not data["seasons"]:
+                del data["seasons"]
+        return data
 
     @classmethod
     def flat_to_seasons(cls, items):
@@ -223,16 +330,18 @@ class TraktItem:
 
     @classmethod
     def typed_string(cls, items):
-        sorted_items = sorted(items, key=lambda x: cls.type_name(x))
-        grouped = dict((f"{k}s", list(g)) for k, g in groupby(sorted_items, lambda x: cls.type_name(x)))
-        return cls.typed_string_for_grouped(grouped)
+        return cls._typed_string_for_counts(Counter(f"{cls.type_name(x)}s" for x in items))
 
     @classmethod
     def typed_string_for_grouped(cls, grouped):
+        return cls._typed_string_for_counts(dict((k, len(v)) for k, v in grouped.items()))
+
+    @classmethod
+    def _typed_string_for_counts(cls, counts):
         total_cnt = 0
         details = ""
         for media_type in ["movies", "shows", "seasons", "episodes"]:
-            cnt = len(grouped[media_type]) if media_type in grouped else 0
+            cnt = counts.get(media_type, 0)
             total_cnt += cnt
             details = f"{details}, {cnt} {media_type}" if cnt else details
         return f"{total_cnt}({details[2:]}) items" if total_cnt else "0 items"
@@ -246,9 +355,11 @@ class TraktItem:
 
 
 class LocalSource:
-    def __init__(self, csv_file, trakt):
+    def __init__(self, csv_file, trakt, workers=4, id_store=None):
         self.csv_file = csv_file
         self.trakt: TraktSource = trakt
+        self.workers = workers
+        self.id_store: IdStore = id_store
         self.items = None
         pass
 
@@ -266,38 +377,79 @@ class LocalSource:
         2. get media type, cause there is no show/episode for douban, only 'movie' or 'season' here.
         2. for 'season', get trakt id of the show, the season number and also the episode ids
         3. for multiple search results, fill info with the first, and record all results in 'candidates'
+        identical 'imdb_id's are searched once, searches run in a pool of `workers` threads under the trakt rate limiter
         """
         # init/clear props
         for item in filter(lambda x: not LocalItem.validate_id(x), items):
             LocalItem.reset_trakt_info(item)
 
         to_update = list(filter(lambda x: x.get("imdb_id") and not x.get("trakt_id"), items))
+        if self.id_store:
+            # keep ids already resolved in the csv, they survive a regenerated csv
+            self.id_store.put_many([(x["imdb_id"], x) for x in items if x.get("imdb_id") and LocalItem.validate_id(x)])
+
         if to_update:
-            logger.info("information: start to update information for {} items...".format(len(to_update)))
+            grouped = {}
+            for item in to_update:
+                grouped.setdefault(item["imdb_id"], []).append(item)
+
+            logger.info("information: start to update information for {} items, {} unique imdb ids...".format(len(to_update), len(grouped)))
             failures = []
             success_count = 0
-
-            for index, item in enumerate(to_update):
-                logger.debug("  [{}/{}]  Update information for {}".format(index + 1, len(to_update), LocalItem.to_string(item)))
-                media, candidates = self.trakt.search_movie_or_season_by_id(item["imdb_id"], "imdb")
-                # media is 'Movie' or 'Season'
-                if media:
-                    item["trakt_id"] = TraktItem.get_trakt_id(media)
-                    item["media_type"] = TraktItem.type_name(media)
-                    if TraktItem.type_name(media) == "season":
-                        item["trakt_show_id"] = TraktItem.get_trakt_id(media.show)
-                        item["season_number"] = media.pk
-                        item["trakt_episode_ids"] = ",".join([TraktItem.get_trakt_id(x) for x in media.episodes.values()])
-                    if candidates:
-                        item["candidates"] = ";\n".join(list(TraktItem.to_string(x) for x in candidates))
-
-                    success_count += 1
-                    logger.debug(
-                        "    Get trakt success, id: {}, type: {}, link: {}".format(item["trakt_id"], item["media_type"], TraktItem.link(media))
-                    )
+            start = time.monotonic()
+
+            to_search = []
+            stored_count = 0
+            for imdb_id, group in grouped.items():
+                stored = self.id_store.get(imdb_id) if self.id_store else None
+                if stored and stored["found"]:
+                    for item in group:
+                        item.update(dict((x, stored[x]) for x in ID_FIELDS))
+                    success_count += len(group)
+                    stored_count += len(group)
+                elif stored and stored["retry_after"] and stored["retry_after"] > time.time():
+                    failures.extend(group)
                 else:
-                    failures.append(item)
-                    logger.warning("    Get trakt failed, imdb link: https://trakt.tv/search/imdb/{}".format(item["imdb_id"]))
+                    to_search.append(imdb_id)
+            if self.id_store:
+                logger.info("  {} items from the id store, {} imdb ids to search".format(stored_count, len(to_search)))
+
+            if to_search:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="trakt-search") as executor:
+                    futures = dict((executor.submit(metrics.bind(self.trakt.search_movie_or_season_by_id), imdb_id, "imdb"), imdb_id) for imdb_id in to_search)
+                    with tqdm(total=len(futures), ascii=True, dynamic_ncols=True, unit="id", desc=f"{' '*50}Searching...") as progress:
+                        for future in as_completed(futures):
+                            imdb_id = futures[future]
+                            error = None
+                            try:
+                                media, candidates = future.result()
+                            except Exception as e:
+                                logger.error("    Search {} failed, e: {}".format(imdb_id, e))
+                                media, candidates, error = None, None, e
+
+                            # media is 'Movie' or 'Season'
+                            info = self._trakt_info(media, candidates) if media else None
+                            if self.id_store:
+                                if info:
+                                    self.id_store.put(imdb_id, info)
+                                elif not error:
+                                    # not found on trakt, errors are retried on the next run
+                                    self.id_store.put_failure(imdb_id)
+
+                            for item in grouped[imdb_id]:
+                                logger.debug("  Update information for {}".format(LocalItem.to_string(item)))
+                                if info:
+                                    item.update(info)
+                                    success_count += 1
+                                    logger.debug(
+                                        "    Get trakt success, id: {}, type: {}, link: {}".format(
+                                            item["trakt_id"], item["media_type"], TraktItem.link(media)
+                                        )
+                                    )
+                                else:
+                                    failures.append(item)
+                                    logger.warning("    Get trakt failed, imdb link: https://trakt.tv/search/imdb/{}".format(item["imdb_id"]))
+                            progress.update(1)
 
             if success_count > 0:
                 with open(self.csv_file, "w", encoding="utf-8") as f:
@@ -305,15 +457,49 @@ class LocalSource:
                     writer.writeheader()
                     writer.writerows(items)
             if failures:
-                logger.warning("  Failed items: {}".format([LocalItem.to_string(item) for x in failures]))
-            logger.info("information: end of update items information, success: {}, failed: {}\n".format(success_count, len(failures)))
+                logger.warning("  Failed items: {}".format([LocalItem.to_string(x) for x in failures]))
+            elapsed = time.monotonic() - start
+            logger.info(
+                "information: end of update items information, success: {}, failed: {}, {:.1f}s, {:.2f} ids/s\n".format(
+                    success_count, len(failures), elapsed, len(to_search) / elapsed if elapsed else 0
+                )
+            )
+
+    @staticmethod
+    def _trakt_info(media, candidates):
+        info = {
+            "trakt_id": TraktItem.get_trakt_id(media),
+            "media_type": TraktItem.type_name(media),
+        }
+        if TraktItem.type_name(media) == "season":
+            info["trakt_show_id"] = TraktItem.get_trakt_id(media.show)
+            info["season_number"] = media.pk
+            info["trakt_episode_ids"] = ",".join([TraktItem.get_trakt_id(x) for x in media.episodes.values()])
+        if candidates:
+            info["candidates"] = ";\n".join(list(TraktItem.to_string(x) for x in candidates))
+        return info
 
 
 class TraktSource:
     def __init__(self, config):
         self.timeout = (5, 120)
+        # initial size of the batches to sync/*, adapted to the responses, see BatchSizer
         self.post_page_size = 100
-        self.get_page_size = 10000
+        self.max_post_page_size = 1000
+        self.batch_sizers = {}
+        self.batch_lock = threading.Lock()
+        # pages of the remote lists, fetched concurrently after the first one
+        self.get_page_size = 1000
+        self.page_workers = 4
+        # "optimistic" trusts the responses of add/remove, "full" downloads the remote list again to verify
+        self.verify = config.get("verify") or "optimistic"
+        # also remove remote items not on douban any more, and update changed ratings
+        self.delta = bool(config.get("delta"))
+        # write requests are recorded in the plan instead of sent, see Client
+        self.plan = None
+        self.cleared = set()
+        # profiles the verification steps as phases of their own, see Client
+        self.profiler = None
         self.auth_file = WorkingDir.get(".trakt_auth")
 
         self.client_id = config["client_id"]
@@ -332,11 +518,38 @@ class TraktSource:
 
         self.username = None
 
+        if config.get("base_url"):
+            # e.g. a local stand-in of the api
+            Trakt.base_url = config["base_url"].rstrip("/")
+
+        # shared by trakt.py and the raw requests, since both go through the pooled session
+        self.limiter = HeaderRateLimiter()
+        http.throttle(Trakt.base_url, self.limiter)
+
         self.inited = False
+        self.init_lock = threading.Lock()
+
+        # show id -> raw seasons with episodes
+        self.seasons = {}
+        self.seasons_lock = threading.Lock()
+        self.show_locks = {}
+        self.season_cache = FileCache(WorkingDir.get_output("cache/seasons"), ttl=config["season_cache_days"] * 24 * 3600)
+        self.season_cache.evict()
+
+        # remote collection name -> last known raw items
+        self.snapshots = FileCache(WorkingDir.get_output("cache/snapshots"))
+
+        # item key -> comment id, so that comments need no full listing to resume or diff
+        self.comment_workers = config["comment_workers"]
+        self.max_retries = config["max_retries"]
+        self.retry_seconds = 2
+        self.comment_log = Journal(WorkingDir.get_output("trakt_comments.jsonl"))
+        self.comments_lock = threading.RLock()
+        self.posted_comments = None
 
     def get_watchlist(self):
-        medias = Trakt["sync/watchlist"].get(pagination=True, per_page=self.get_page_size, flat=True)
-        return list(medias) if isinstance(medias, PaginationIterator) else (medias if medias else [])
+        raw = self._get_snapshot("watchlist", lambda: self._get_raw_pages(Trakt["sync/watchlist"]))
+        return list(SyncMapper.process(Trakt.client, None, raw, flat=True, in_watchlist=True))
 
     def clear_watchlist(self):
         self._clear_impl("watchlist", self.get_watchlist, Trakt["sync/watchlist"])
@@ -349,10 +562,10 @@ class TraktSource:
         Get watched 'movies' and 'shows'
         for 'shows', it will expand to Episodes
         """
+        raw = self._get_snapshot("watched", lambda: dict((x, self._get_raw(Trakt["sync/watched"], media=x)) for x in ["movies", "shows"]))
         medias = []
         for media_type in ["movies", "shows"]:
-            watched = Trakt["sync/watched"].get(media=media_type)
-            self._delay_for_get()
+            watched = SyncMapper.process(Trakt.client, None, raw[media_type], media=media_type, is_watched=True)
             if watched:
                 if media_type == "shows" and flat_to_seasons:
                     medias.extend(TraktItem.flat_to_seasons(watched))
@@ -364,18 +577,24 @@ class TraktSource:
         self._clear_impl("watched", self.get_watched, Trakt["sync/history"])
 
     def add_watched(self, items):
-        self._add_impl("watched", items, LocalItem.validate_id_date, lambda: self.get_watched(True), LocalItem.data_id_watched, Trakt["sync/history"])
+        self._add_impl("watched", items, LocalItem.validate_id_date, lambda: self.get_watched(True), LocalItem.data_id_watched, Trakt["sync/history"], idempotent=False)
 
     def get_ratings(self):
-        ratings = Trakt["sync/ratings"].all(pagination=True, per_page=self.get_page_size, flat=True)
-        return list(ratings) if isinstance(ratings, PaginationIterator) else (ratings if ratings else [])
+        raw = self._get_snapshot("ratings", lambda: self._get_raw_pages(Trakt["sync/ratings"], media="all"))
+        return list(SyncMapper.process(Trakt.client, None, raw, media="all", flat=True))
 
     def clear_ratings(self):
         self._clear_impl("ratings", self.get_ratings, Trakt["sync/ratings"])
 
     def add_ratings(self, items):
         self._add_impl(
-            "ratings", items, LocalItem.validate_id_date_rating, lambda: self.get_ratings(), LocalItem.data_id_rating, Trakt["sync/ratings"]
+            "ratings",
+            items,
+            LocalItem.validate_id_date_rating,
+            lambda: self.get_ratings(),
+            LocalItem.data_id_rating,
+            Trakt["sync/ratings"],
+            changed=lambda local, remote: remote.rating is None or int(local["rating"]) * 2 != remote.rating.value,
         )
 
     def get_username(self):
@@ -387,53 +606,78 @@ class TraktSource:
         return self.username
 
     def get_comments(self):
-        comments = []
-        page = 1
-        per_page = self.get_page_size
-        total_pages = 1
-        while page <= total_pages:
+        return self._get_snapshot("comments", self._get_raw_comments)
+
+    def _get_raw_comments(self):
+        username = self.get_username()
+
+        def get_page(page):
             url = "{base_url}/users/{id}/comments/{comment_type}/{type}?page={page}&limit={limit}".format(
-                base_url=Trakt.base_url, id=self.get_username(), comment_type="all", type="all", page=page, limit=per_page
+                base_url=Trakt.base_url, id=username, comment_type="all", type="all", page=page, limit=self.get_page_size
             )
-            response = requests.get(url, headers=self.headers, timeout=self.timeout)
-            if response:
-                paged = json.loads(response.text)
-                if paged:
-                    comments.extend(paged)
-
-                per_page = int(response.headers.get("x-pagination-limit"))
-                total_pages = int(response.headers.get("x-pagination-page-count"))
-                page += 1
+            response = http.get(url, headers=self.headers, timeout=self.timeout)
+            if not response:
+                raise Exception(f"Get comments failed, page: {page}, response: {response}")
+            return json.loads(response.text) or [], page_count(response)
 
-        return comments
+        return list(iter_pages(get_page, self.page_workers))
 
     def remove_comment(self, id):
-        url = f"{Trakt.base_url}/comments/{id}"
-        response = requests.delete(url, headers=self.headers, timeout=self.timeout)
-        self._delay_for_post()
-        if response.ok and response.status_code == 204:
+        """
+        Remove a comment, retry with backoff like post_comment. A comment already gone counts as removed,
+        so an interrupted clear can simply run again
+        """
+        if self._plan("comments", "remove", "DELETE", f"comments/{id}", None, id=id):
             return True
-        else:
-            logger.warning(f"    Remove comment failed, code:{response.status_code}, text:{response.text}")
+        url = f"{Trakt.base_url}/comments/{id}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = http.delete(url, headers=self.headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, str(e)
+            else:
+                self.snapshots.remove("comments")
+                if response.status_code in [204, 404]:
+                    self._record_comment_removed(id)
+                    return True
+                error = f"code:{response.status_code}, text:{response.text}"
+
+            if attempt < self.max_retries and (response is None or response.status_code == 429 or response.status_code >= 500):
+                self._retry_sleep("DELETE", url, attempt)
+                continue
+            logger.warning(f"    Remove comment {id} failed, {error}")
             return False
 
+    def _retry_sleep(self, method, url, attempt):
+        endpoint = metrics.endpoint(method, url)
+        seconds = self.retry_seconds * 2**attempt
+        metrics.retry(endpoint)
+        metrics.sleep(endpoint, seconds)
+        time.sleep(seconds)
+
+    @staticmethod
+    def is_imported_comment(data):
+        return (data["comment"].get("comment") or "").endswith(COMMENT_SUFFIX)
+
     def clear_comments(self):
         logger.info(f"comments: clear comments...")
-        remote_data = self.get_comments()
+        remote_data, others = split(self.get_comments(), self.is_imported_comment)
         logger.debug("  Get comments: {}".format(TraktItem.typed_string(remote_data)))
+        if others:
+            logger.info(f"  Keep {len(others)} comments not imported from douban")
 
         if remote_data:
-            succeed = 0
-            failed = 0
-            for index in trange(len(remote_data), dynamic_ncols=True, ascii=True, unit="comment", desc=f"{' '*50}Removing..."):
-                data = remote_data[index]
-                if self.remove_comment(data["comment"]["id"]):
-                    succeed += 1
-                else:
-                    failure += 1
-
-            logger.debug(f"  Check comments after remove {len(remote_data)}(succeed={succeed}, failed={failed}) comments...")
-            remote_data = self.get_comments()
+            succeed, failed = self._remove_comments(remote_data)
+            if self.plan is not None:
+                self.cleared.add("comments")
+                remote_data = []
+            elif self.verify == "full" or failed:
+                logger.debug(f"  Check comments after remove {len(remote_data)}(succeed={succeed}, failed={failed}) comments...")
+                with self._phase("verify comments"):
+                    remote_data, _ = split(self.get_comments(), self.is_imported_comment)
+            else:
+                remote_data = []
+            logger.info(f"  Removed: {succeed}, failed: {failed}, remained: {len(remote_data)}, kept: {len(others)}")
             if len(remote_data) > 0:
                 logger.error("Error of clear comments, {} items remained: {}".format(len(remote_data), [TraktItem.to_string(x) for x in remote_data]))
                 exit(1)
@@ -441,49 +685,150 @@ class TraktSource:
                 logger.debug("  Clear success")
         logger.info(f"comments: end of clear comments\n")
 
+    def _remove_comments(self, remote_data):
+        """
+        Remove the raw comments concurrently, return the numbers of succeed and failed
+        """
+        succeed = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.comment_workers, thread_name_prefix="comment") as executor:
+            futures = [executor.submit(metrics.bind(self.remove_comment), x["comment"]["id"]) for x in remote_data]
+            with tqdm(total=len(futures), dynamic_ncols=True, ascii=True, unit="comment", desc=f"{' '*50}Removing...") as bar:
+                for future in as_completed(futures):
+                    if future.result():
+                        succeed += 1
+                    else:
+                        failed += 1
+                    bar.update()
+        return succeed, failed
+
     def post_comment(self, item):
-        url = f"{Trakt.base_url}/comments"
-        data = LocalItem.data_id_comment(item)
-        response = requests.post(url, data=json.dumps(data), headers=self.headers, timeout=self.timeout)
-        self._delay_for_post()
-        if response.ok:
+        return self._post_comment(LocalItem.key(item), LocalItem.data_id_comment(item), LocalItem.to_string_with_comment(item))
+
+    def _post_comment(self, key, data, description):
+        """
+        Post the comment and record its comment id, retry with backoff on rate limits,
+        gateway errors and connection errors. Return the comment id, None if failed
+        """
+        if self._plan("comments", "add", "POST", "comments", data, key=key):
             return True
-        else:
-            logger.warning(
-                f"    Post comment failed, code:{response.status_code}, text:{response.text}, item: {LocalItem.to_string_with_comment(item)}"
-            )
-            return False
+        url = f"{Trakt.base_url}/comments"
+        data = json.dumps(data)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = http.post(url, data=data, headers=self.headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, str(e)
+            else:
+                self.snapshots.remove("comments")
+                if response.ok:
+                    comment_id = response.json().get("id") if response.text else None
+                    self._record_comment(key, comment_id)
+                    return comment_id or True
+                error = f"code:{response.status_code}, text:{response.text}"
+
+            # other errors would fail again, and a 500 may have posted the comment already
+            if attempt < self.max_retries and (response is None or response.status_code in [429, 502, 503, 504]):
+                self._retry_sleep("POST", url, attempt)
+                continue
+            logger.warning(f"    Post comment failed, {error}, item: {description}")
+            return None
+
+    def _posted_comments(self):
+        """
+        Item key -> comment id of the comments posted or seen before, replayed from the local comment log
+        """
+        with self.comments_lock:
+            if self.posted_comments is None:
+                self.posted_comments = {}
+                for record in self.comment_log.replay():
+                    if "deleted" in record:
+                        self._forget_comment(record["deleted"])
+                    else:
+                        self.posted_comments[record["key"]] = record["id"]
+            return self.posted_comments
+
+    def _record_comment(self, key, comment_id):
+        posted = self._posted_comments()
+        with self.comments_lock:
+            posted[key] = comment_id
+            self.comment_log.append({"key": key, "id": comment_id})
+
+    def _record_comment_removed(self, comment_id):
+        self._posted_comments()
+        with self.comments_lock:
+            self._forget_comment(comment_id)
+            self.comment_log.append({"deleted": comment_id})
+
+    def _forget_comment(self, comment_id):
+        for key in [k for k, v in self.posted_comments.items() if v == comment_id]:
+            del self.posted_comments[key]
 
     def add_comments(self, items):
         def filter_to_add(_remote_data):
-            _valid, _invalid = split(items, LocalItem.validate_id_comment)
-            _remote_dict = dict([(TraktItem.key(x), x) for x in _remote_data])
-            _added, _to_add = split(_valid, lambda x: _remote_dict.get(LocalItem.key(x)))
-            return _to_add, _added, _invalid
+            _diff = diff(items, _remote_data, LocalItem.index_key, TraktItem.index_key, LocalItem.validate_id_comment)
+            return _diff.to_add, _diff.present, _diff.invalid
+
+        def filter_to_add_posted():
+            _diff = diff(items, self._posted_comments(), LocalItem.key, None, LocalItem.validate_id_comment)
+            return _diff.to_add, _diff.present, _diff.invalid
 
         logger.info(f"comments: add {LocalItem.typed_string(items)} to comments...")
-        to_add, added, invalid_items = filter_to_add(self.get_comments())
+        posted = self._posted_comments()
+        to_remove = []
+        if "comments" in self.cleared:
+            # planned to be cleared before
+            to_add, added, invalid_items = filter_to_add([])
+        # removals need the texts of the remote comments
+        elif self.verify == "full" or self.delta or not posted:
+            remote_data = self.get_comments()
+            # remember the imported remote comments, keyed like LocalItem.key, later runs diff against the comment log only
+            for x in filter(self.is_imported_comment, remote_data):
+                if TraktItem.index_key(x) is not None and posted.get(TraktItem.key(x)) != x["comment"]["id"]:
+                    self._record_comment(TraktItem.key(x), x["comment"]["id"])
+            to_add, added, invalid_items = filter_to_add(remote_data)
+            if self.delta:
+                imported = filter(self.is_imported_comment, remote_data)
+                to_remove = self._delta_removals(diff(items, imported, LocalItem.index_key, TraktItem.index_key, LocalItem.validate_id_comment))
+                if invalid_items:
+                    logger.warning("  Nothing is removed from comments while local items are invalid")
+        else:
+            to_add, added, invalid_items = filter_to_add_posted()
         if invalid_items or added:
             if invalid_items:
                 logger.warning("  {} invalid items: {}".format(len(invalid_items), [LocalItem.to_string(x) for x in invalid_items]))
             if added:
                 logger.info("  Already added: {}".format(LocalItem.typed_string(added)))
         logger.info("  To add: {}".format(LocalItem.typed_string(to_add)))
+        if to_remove:
+            logger.info("  To remove: {}".format(TraktItem.typed_string(to_remove)))
+            succeed, failed = self._remove_comments(to_remove)
+            logger.info(f"    Removed: {succeed}, failed: {failed}")
 
         if to_add:
             succeed = 0
             failed_items = []
-            for index in trange(len(to_add), ascii=True, dynamic_ncols=True, unit="comment", desc=f"{' '*50}Posting..."):
-                data = to_add[index]
-                if self.post_comment(data):
-                    succeed += 1
-                else:
-                    failed_items.append(data)
-
-            logger.debug(f"  Check comments after add {len(to_add)}(succeed={succeed}, failed={len(failed_items)}) comments...")
-            remote_data = self.get_comments()
-            logger.debug(f"    {TraktItem.typed_string(remote_data)}")
-            to_add, _, _ = filter_to_add(remote_data)
+            # bounded concurrency, the pace is kept by the rate limiter of trakt
+            with ThreadPoolExecutor(max_workers=self.comment_workers, thread_name_prefix="comment") as executor:
+                futures = dict((executor.submit(metrics.bind(self.post_comment), x), x) for x in to_add)
+                with tqdm(total=len(futures), ascii=True, dynamic_ncols=True, unit="comment", desc=f"{' '*50}Posting...") as bar:
+                    for future in as_completed(futures):
+                        if future.result():
+                            succeed += 1
+                        else:
+                            failed_items.append(futures[future])
+                        bar.update()
+
+            if self.plan is not None:
+                to_add = []
+            elif self.verify == "full":
+                logger.debug(f"  Check comments after add {len(to_add)}(succeed={succeed}, failed={len(failed_items)}) comments...")
+                with self._phase("verify comments"):
+                    remote_data = self.get_comments()
+                    logger.debug(f"    {TraktItem.typed_string(remote_data)}")
+                    to_add, _, _ = filter_to_add(remote_data)
+            else:
+                to_add = failed_items
             if to_add:
                 logger.warning(f"    Not added: {LocalItem.typed_string(to_add)}")
                 logger.warning("      {}".format([LocalItem.to_string_with_comment(x) for x in to_add]))
@@ -493,7 +838,6 @@ class TraktSource:
         self._check_init()
 
         medias = Trakt["search"].lookup(item_id, id_type)
-        self._delay_for_get()
 
         media = medias[0] if medias else None
         if media:
@@ -510,41 +854,96 @@ class TraktSource:
         return media, medias[1:] if medias and len(medias) > 1 else None
 
     def get_season_with_episodes(self, show_id, season):
-        seasons = Trakt["shows"].seasons(show_id, extended="episodes")
-        self._delay_for_get()
-        return next(filter(lambda x: x.pk == season, seasons))
+        return next(filter(lambda x: x.pk == season, self.get_seasons(show_id)))
+
+    def get_seasons(self, show_id):
+        """
+        Get all seasons with episodes of the show, the response is cached in memory and on disk,
+        so later seasons of the same show need no request
+        """
+        key = str(show_id)
+        with self.seasons_lock:
+            show_lock = self.show_locks.setdefault(key, threading.Lock())
+
+        # one request per show even if its seasons are searched concurrently
+        with show_lock:
+            raw = self.seasons.get(key)
+            if raw is None:
+                text = self.season_cache.get(key)
+                if text is None:
+                    response = Trakt["shows"].seasons(show_id, extended="episodes", parse=False)
+                    if response is None or not response.ok:
+                        logger.warning(f"    Get seasons of show {show_id} failed, response: {response}")
+                        return []
+                    text = response.text
+                    self.season_cache.put(key, text)
+                raw = json.loads(text)
+                self.seasons[key] = raw
+        # map to new objects every time, callers update their 'show'
+        return SummaryMapper.seasons(Trakt.client, raw) or []
+
+    def _add_impl(self, name, items, validate, get_remote, item_to_data, trakt_client, changed=None, idempotent=True):
+        """
+        Add items missing on remote. In delta mode, also add again the items changed(local, remote),
+        and remove the remote items not in items. An add not idempotent, e.g. a play of history,
+        is sent again after a failure only for the items not found on remote then
+        """
 
-    def _add_impl(self, name, items, validate, get_remote, item_to_data, trakt_client):
         def filter_to_add(_remote_data):
-            _valid, _invalid = split(items, validate)
-            _remote_dict = dict([(TraktItem.key(x), x) for x in _remote_data])
-            _added, _to_add = split(_valid, lambda x: _remote_dict.get(LocalItem.key(x)))
-            return _to_add, _added, _invalid
+            _remote = index_by(_remote_data, TraktItem.index_key)
+            _diff = diff(items, _remote, LocalItem.index_key, TraktItem.index_key, validate)
+            _to_add, _added = _diff.to_add, _diff.present
+            if self.delta and changed:
+                _changed, _added = split(_added, lambda x: changed(x, _remote[LocalItem.index_key(x)]))
+                _to_add = _to_add + _changed
+            return _to_add, _added, _diff.invalid, self._delta_removals(_diff)
 
         logger.info(f"{name}: add {LocalItem.typed_string(items)} to {name}...")
-        to_add, added, invalid_items = filter_to_add(get_remote())
+        to_add, added, invalid_items, to_remove = filter_to_add([] if name in self.cleared else get_remote())
         if invalid_items or added:
             if invalid_items:
                 logger.warning("  {} invalid items: {}".format(len(invalid_items), [LocalItem.to_string(x) for x in invalid_items]))
+                if self.delta:
+                    logger.warning("  Nothing is removed from {} while local items are invalid".format(name))
             if added:
                 logger.info("  Already added: {}".format(LocalItem.typed_string(added)))
         logger.info("  To add: {}".format(LocalItem.typed_string(to_add)))
 
+        if to_remove:
+            logger.info("  To remove: {}".format(TraktItem.typed_string(to_remove)))
+            remained = self._remove_items(name, to_remove, trakt_client)
+            if remained and self.verify != "full":
+                logger.warning(f"    Not removed: {remained}")
+
+        def not_applied(batch):
+            remote = index_by(get_remote(), TraktItem.index_key)
+            return [x for x in batch if LocalItem.index_key(x) not in remote]
+
+        not_added = []
         if to_add:
-            data_list = LocalItem.segment_data(to_add, item_to_data, self.post_page_size)
-            for index, data in enumerate(data_list):
-                logger.debug("  [{}/{}]  Add {} for {}".format(index + 1, len(data_list), name, TraktItem.typed_string_for_grouped(data)))
-                response = trakt_client.add(data)
-                self._delay_for_post()
-                logger.debug(f"    Response: {response}")
-
-            logger.debug(f"  Check {name} after add...")
-            remote_data = get_remote()
-            logger.debug(f"    {TraktItem.typed_string(remote_data)}")
-            to_add, _, _ = filter_to_add(remote_data)
-            if to_add:
-                logger.warning(f"    Not added: {LocalItem.typed_string(to_add)}")
-                logger.warning("      {}".format([LocalItem.to_string(x) for x in to_add]))
+            sorted_items = sorted(to_add, key=lambda x: x["media_type"])
+            counts = {}
+            for batch, data, response in self._send_batches(
+                name, "add", sorted_items, lambda x: LocalItem.to_data(x, item_to_data), trakt_client, None if idempotent else not_applied
+            ):
+                not_added.extend(LocalItem.filter_not_found(batch, response))
+                self._count_response(counts, response)
+            # trust the response bodies, items not in "not_found" of a successful response are added
+            logger.debug(f"  Responses of {name}: {counts}")
+
+        if self.plan is not None:
+            not_added = []
+        elif self.verify == "full" and (to_add or to_remove):
+            logger.debug(f"  Check {name} after changes...")
+            with self._phase(f"verify {name}"):
+                remote_data = get_remote()
+                logger.debug(f"    {TraktItem.typed_string(remote_data)}")
+                not_added, _, _, not_removed = filter_to_add(remote_data)
+            if not_removed:
+                logger.warning("    Not removed: {}".format([TraktItem.to_string(x) for x in not_removed]))
+        if not_added:
+            logger.warning(f"    Not added: {LocalItem.typed_string(not_added)}")
+            logger.warning("      {}".format([LocalItem.to_string(x) for x in not_added]))
         logger.info(f"{name}: end of add items to watched\n")
 
     def _clear_impl(self, name, get_remote, trakt_client):
@@ -552,37 +951,253 @@ class TraktSource:
         remote_data = get_remote()
         logger.debug("  Get {}: {}".format(name, TraktItem.typed_string(remote_data)))
 
-        data_list = TraktItem.segment_data(remote_data, self.post_page_size)
-        if data_list:
-            for index, data in enumerate(data_list):
-                logger.debug("  [{}/{}]  Remove {} for {}".format(index + 1, len(data_list), name, TraktItem.typed_string_for_grouped(data)))
-                response = trakt_client.remove(data)
-                self._delay_for_post()
-                logger.debug(f"    Response: {response}")
-
-            logger.debug(f"  Check {name} after remove...")
-            remote_data = get_remote()
+        if remote_data:
+            remained = self._remove_items(name, remote_data, trakt_client)
+            if self.plan is not None:
+                self.cleared.add(name)
+                remote_data = []
+            elif self.verify == "full":
+                logger.debug(f"  Check {name} after remove...")
+                with self._phase(f"verify {name}"):
+                    remote_data = get_remote()
+            else:
+                remote_data = remained
             if len(remote_data) > 0:
-                logger.error("Error of clear {}, {} items remained: {}".format(name, len(remote_data), [TraktItem.to_string(x) for x in remote_data]))
+                logger.error(
+                    "Error of clear {}, {} items remained: {}".format(
+                        name, len(remote_data), [x if isinstance(x, dict) else TraktItem.to_string(x) for x in remote_data]
+                    )
+                )
                 exit(1)
             else:
                 logger.debug("  Clear success")
         logger.info(f"{name}: end of clear {name}\n")
 
-    def _wrap_request(self, make_request, progress):
-        response = make_request()
-        self._delay_for_post()
-        logger.debug(f"    Response: {response}")
-        pass
+    def _delta_removals(self, _diff):
+        """
+        Remote items of a diff to remove in delta mode. None while a local item is invalid, e.g. its trakt id
+        is not resolved this run, since its remote entries would look like removed from douban
+        """
+        if not self.delta or _diff.invalid:
+            return []
+        return _diff.to_remove
 
-    def _check_init(self):
-        if not self.inited:
-            Trakt.configuration.defaults.client(id=self.client_id, secret=self.client_secret)
-            Trakt.configuration.defaults.http(timeout=self.timeout)
-            Trakt.on("oauth.token_refreshed", self._update_authenticate)
+    @contextmanager
+    def _phase(self, name):
+        """
+        Metrics and profile of a step inside a phase as a phase of its own, e.g. the verification after changes
+        """
+        with metrics.phase(name), self.profiler.phase(name) if self.profiler else nullcontext():
+            yield
 
-            self._authenticate()
-            self.inited = True
+    def _remove_items(self, name, remote_data, trakt_client):
+        """
+        Remove remote items in batches, return the ids not removed according to the responses
+        """
+        sorted_items = sorted(remote_data, key=lambda x: TraktItem.type_name(x))
+        remained = []
+        counts = {}
+        for _, data, response in self._send_batches(name, "remove", sorted_items, TraktItem.to_data, trakt_client):
+            if not isinstance(response, dict):
+                remained.extend(x for group in data.values() for x in group)
+            else:
+                remained.extend(x for group in (response.get("not_found") or {}).values() if isinstance(group, list) for x in group)
+                self._count_response(counts, response)
+        logger.debug(f"  Responses of {name}: {counts}")
+        return remained
+
+    def _send_batches(self, name, action, items, to_data, trakt_client, not_applied=None):
+        """
+        Send items to trakt_client.add or trakt_client.remove in batches sized by the responses so far.
+        A batch failed by a timeout, a connection error or a server error is split in half and sent again,
+        until a single item fails. A batch rejected by a client error (4xx) fails as a whole, it is not sent again.
+        For requests not idempotent, not_applied(batch) returns the items of a failed batch missing on remote,
+        only those are sent again. Yield (batch items, data, response), the response is None for the failed items
+        """
+        sizer = self._batch_sizer(name)
+        position = 0
+        retries = []
+        sent = 0
+        while retries or position < len(items):
+            if retries:
+                batch = retries.pop()
+            else:
+                batch = items[position : position + sizer.size]
+                position += len(batch)
+            data = to_data(batch)
+            logger.debug("  [{}/{}]  {} {} for {}".format(sent + len(batch), len(items), action.capitalize(), name, TraktItem.typed_string_for_grouped(data)))
+
+            start = time.monotonic()
+            split = False
+            try:
+                response = self._sync(name, action, trakt_client, data)
+            except ClientError as e:
+                response = None
+                logger.warning(f"    {action.capitalize()} {name} of {len(batch)} items rejected: {e.status_code} {e}")
+            except (ServerError, RequestFailedError, requests.RequestException) as e:
+                response = None
+                split = True
+                logger.debug(f"    Error: {e}")
+            seconds = time.monotonic() - start
+            logger.debug(f"    Response: {response}")
+
+            if response is not None:
+                if self.plan is None:
+                    sizer.success(len(batch), seconds, len(json.dumps(data)))
+                sent += len(batch)
+                yield batch, data, response
+                continue
+
+            if split:
+                sizer.failure()
+            if split and not_applied is not None:
+                # the failed request may have been applied, in part or in full
+                try:
+                    missing = not_applied(batch)
+                except Exception as e:
+                    logger.warning(f"    Check of the failed {action} {name} failed: {e}")
+                    missing, split = batch, False
+                applied = [x for x in batch if x not in missing]
+                if applied:
+                    logger.debug(f"    Failed, but {len(applied)} of {len(batch)} items are on remote")
+                    sent += len(applied)
+                    yield applied, to_data(applied), {}
+                if not missing:
+                    continue
+                batch, data = missing, to_data(missing)
+
+            if split and len(batch) > 1:
+                half = len(batch) // 2
+                logger.debug(f"    Failed, send again as {half} and {len(batch) - half} items, batch size: {sizer.size}")
+                retries.append(batch[half:])
+                retries.append(batch[:half])
+            else:
+                sent += len(batch)
+                yield batch, data, None
+
+    def _batch_sizer(self, name):
+        with self.batch_lock:
+            if name not in self.batch_sizers:
+                self.batch_sizers[name] = BatchSizer(self.post_page_size, max_size=self.max_post_page_size)
+            return self.batch_sizers[name]
+
+    def _sync(self, name, action, trakt_client, data):
+        """
+        Send a batch to trakt_client.add or trakt_client.remove, or only record it when planning.
+        A failed request raises ClientError, ServerError or RequestFailedError of trakt.py
+        """
+        if self._plan(name, action, "POST", trakt_client.path, data):
+            # as if everything was found
+            return {"not_found": {}}
+        try:
+            return getattr(trakt_client, action)(data, exceptions=True)
+        finally:
+            # a failed request may have changed the collection too
+            self.snapshots.remove(name)
+
+    def _plan(self, collection, action, method, path, data, **extra):
+        """
+        Record the request in the plan instead of sending it, False if not planning
+        """
+        if self.plan is None:
+            return False
+        self.plan.add(collection, action, method, path, data, **extra)
+        return True
+
+    def apply(self, plan, phases):
+        """
+        Send the batches of a plan as they are, the collections run as concurrent phases
+        """
+        self._check_init()
+        failed = []
+
+        def apply_collection(collection, batches):
+            for index, batch in enumerate(batches):
+                logger.debug(f"  [{index + 1}/{len(batches)}]  {batch['action'].capitalize()} {collection}: {batch['method']} {batch['path']}")
+                if collection == "comments":
+                    if batch["action"] == "add":
+                        ok = self._post_comment(batch["key"], batch["data"], batch["key"])
+                    else:
+                        ok = self.remove_comment(batch["id"])
+                else:
+                    try:
+                        response = self._sync(collection, batch["action"], Trakt[batch["path"]], batch["data"])
+                    except (RequestError, RequestFailedError, requests.RequestException) as e:
+                        response = None
+                        logger.warning(f"    Error: {e}")
+                    logger.debug(f"    Response: {response}")
+                    not_found = [x for group in ((response or {}).get("not_found") or {}).values() if isinstance(group, list) for x in group]
+                    if not_found:
+                        logger.warning(f"    Not found: {not_found}")
+                    ok = response is not None
+                if not ok:
+                    failed.append(batch)
+
+        phases.run([(f"apply {k}", lambda k=k, v=v: apply_collection(k, v)) for k, v in plan.collections().items()])
+        return failed
+
+    @staticmethod
+    def _count_response(counts, response):
+        """
+        Sum up "added", "existing" and "deleted" counts of a sync/* response
+        """
+        for field in ["added", "existing", "deleted"]:
+            for media_type, count in ((response or {}).get(field) or {}).items():
+                if isinstance(count, int):
+                    counts[field] = counts.get(field, 0) + count
+
+    def _get_snapshot(self, name, get_raw):
+        """
+        Get raw items of a remote collection from its local snapshot, the snapshot is valid as long as
+        the collection's timestamps in 'sync/last_activities' are unchanged, or downloaded again by get_raw
+        """
+        fingerprint = self._activity_fingerprint(name)
+        if fingerprint:
+            text = self.snapshots.get(name)
+            snapshot = json.loads(text) if text else None
+            if snapshot and snapshot["fingerprint"] == fingerprint:
+                logger.debug(f"  {name} unchanged, use the local snapshot")
+                return snapshot["items"]
+
+        raw = get_raw()
+        if fingerprint:
+            self.snapshots.put(name, json.dumps({"fingerprint": fingerprint, "items": raw}))
+        return raw
+
+    def _activity_fingerprint(self, name):
+        self._check_init()
+        activities = Trakt["sync"].last_activities()
+        if not activities:
+            return None
+        return [activities.get(media, {}).get(field) for media, field in ACTIVITY_FIELDS[name]]
+
+    def _get_raw(self, interface, **kwargs):
+        response = interface.get(parse=False, **kwargs)
+        if response is None or not response.ok:
+            raise Exception(f"Get {interface.path} failed, response: {response}")
+        return response.json() or []
+
+    def _get_raw_pages(self, interface, **kwargs):
+        def get_page(page):
+            response = interface.get(page=page, per_page=self.get_page_size, flat=True, parse=False, **kwargs)
+            if response is None or not response.ok:
+                raise Exception(f"Get {interface.path} failed, page: {page}, response: {response}")
+            return response.json() or [], page_count(response)
+
+        return list(iter_pages(get_page, self.page_workers))
+
+    def _check_init(self):
+        # searches call it from worker threads, authenticate only once
+        with self.init_lock:
+            if not self.inited:
+                Trakt.configuration.defaults.client(id=self.client_id, secret=self.client_secret)
+                Trakt.configuration.defaults.http(timeout=self.timeout)
+                # share the pooled session with the raw requests
+                Trakt.http.session = http.session
+                Trakt.on("oauth.token_refreshed", self._update_authenticate)
+
+                self._authenticate()
+                self.inited = True
 
     def _authenticate(self):
         # try to read form auth_file
@@ -615,44 +1230,117 @@ class TraktSource:
             with open(self.auth_file, "w") as f:
                 yaml.dump(auth, f)
 
-    @staticmethod
-    def _delay_for_post():
-        time.sleep(1)
-
-    @staticmethod
-    def _delay_for_get():
-        time.sleep(0.5)
-
 
 class Client:
-    def __init__(self):
+    def __init__(self, verify=None, delta=None, plan_file=None, apply_file=None, profile=False):
+        self.verify = verify
+        self.delta = delta
+        self.profile = profile
+        # write the requests to plan_file instead of sending them, or send the requests of apply_file
+        self.plan_file = plan_file
+        self.apply_file = apply_file
         self.config = {}
         self.config_file = WorkingDir.get("config.yaml")
         self.local_file = WorkingDir.get_output("douban.csv")
+        self.id_file = WorkingDir.get_output("trakt_ids.db")
 
     def run(self):
         self._read_config(self.config_file)
         trakt = TraktSource(self.config)
-        local = LocalSource(self.local_file, trakt)
-        items = local.get_items()
-
-        if self.config.get("clear_records"):
-            trakt.clear_watchlist()
-            trakt.clear_watched()
-            trakt.clear_ratings()
-            trakt.clear_comments()
-
-        watchlist_items = list(filter(lambda x: x["type"] == "wish", items))
-        trakt.add_watchlist(watchlist_items)
+        if self.apply_file:
+            self.apply(trakt)
+            return
+        if self.plan_file:
+            trakt.plan = Plan()
+        id_store = IdStore(self.id_file, self.config["id_retry_days"])
+        local = LocalSource(self.local_file, trakt, self.config["resolve_workers"], id_store)
+
+        # the collections are independent, so their phases run concurrently under the shared rate limit of trakt
+        phases = self._phases()
+        trakt.profiler = phases.profiler
+        try:
+            items = phases.run([("resolve", local.get_items)])[0]
+            if self.config.get("clear_records"):
+                phases.run(
+                    [
+                        ("clear watchlist", trakt.clear_watchlist),
+                        ("clear watched", trakt.clear_watched),
+                        ("clear ratings", trakt.clear_ratings),
+                        ("clear comments", trakt.clear_comments),
+                    ]
+                )
+
+            watchlist_items = list(filter(lambda x: x["type"] == "wish", items))
+            watched_items = list(filter(lambda x: x["type"] == "collect", items))
+            rating_items = list(filter(lambda x: x["rating"], items))
+            comments = list(filter(lambda x: x["comment"], items))
+            phases.run(
+                [
+                    ("add watchlist", lambda: trakt.add_watchlist(watchlist_items)),
+                    ("add watched", lambda: trakt.add_watched(watched_items)),
+                    ("add ratings", lambda: trakt.add_ratings(rating_items)),
+                    ("add comments", lambda: trakt.add_comments(comments)),
+                ]
+            )
+        finally:
+            self._finish(phases)
 
-        watched_items = list(filter(lambda x: x["type"] == "collect", items))
-        trakt.add_watched(watched_items)
+        if trakt.plan is not None:
+            trakt.plan.save(self.plan_file)
+            logger.info(f"Plan saved to {self.plan_file}, nothing is sent:")
+            trakt.plan.log_summary()
 
-        rating_items = list(filter(lambda x: x["rating"], items))
-        trakt.add_ratings(rating_items)
+    def resolve(self):
+        """
+        Only resolve the trakt ids of the csv items into the csv and the id store, nothing is sent to trakt
+        """
+        self._read_config(self.config_file)
+        trakt = TraktSource(self.config)
+        id_store = IdStore(self.id_file, self.config["id_retry_days"])
+        local = LocalSource(self.local_file, trakt, self.config["resolve_workers"], id_store)
+        phases = self._phases()
+        try:
+            phases.run([("resolve", local.get_items)])
+        finally:
+            self._finish(phases)
+
+    def apply(self, trakt):
+        try:
+            plan = Plan.load(self.apply_file)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error reading plan file {self.apply_file} with {e}")
+            sys.exit(1)
+        logger.info(f"Apply plan {self.apply_file} created at {plan.created_at}:")
+        plan.log_summary()
+
+        phases = self._phases()
+        try:
+            failed = trakt.apply(plan, phases)
+        finally:
+            self._finish(phases)
+        if failed:
+            logger.error("{} of {} requests failed: {}".format(len(failed), len(plan.batches), [f"{x['method']} {x['path']}" for x in failed]))
+            sys.exit(1)
 
-        comments = list(filter(lambda x: x["comment"], items))
-        trakt.add_comments(comments)
+    def _phases(self):
+        if not self.profile:
+            return Phases(self.config["phase_workers"])
+        # one phase after another, so that the profile of each phase is its own
+        profiler = Profiler(WorkingDir.get_output("profiles/trakt-{}".format(time.strftime("%Y%m%d-%H%M%S"))))
+        return Phases(1, profiler)
+
+    def _finish(self, phases):
+        phases.log_summary()
+        http.log_stats()
+        self._save_metrics()
+        if phases.profiler:
+            phases.profiler.save_report()
+
+    def _save_metrics(self):
+        metrics.log_summary()
+        metrics.save(WorkingDir.get_output("trakt_metrics.json"))
+        if self.config.get("metrics_textfile"):
+            metrics.save_prometheus(self.config["metrics_textfile"], "sync")
 
     def _read_config(self, config_file):
         if os.path.exists(config_file):
@@ -668,6 +1356,27 @@ class Client:
                     sys.exit(1)
                 if not self.config.get("clear_records"):
                     self.config["clear_records"] = False
+                if not self.config.get("resolve_workers"):
+                    self.config["resolve_workers"] = 4
+                if self.config.get("season_cache_days") is None:
+                    self.config["season_cache_days"] = 7
+                if self.config.get("id_retry_days") is None:
+                    self.config["id_retry_days"] = 7
+                if not self.config.get("phase_workers"):
+                    self.config["phase_workers"] = 4
+                if not self.config.get("comment_workers"):
+                    self.config["comment_workers"] = 4
+                if self.config.get("max_retries") is None:
+                    self.config["max_retries"] = 3
+                if self.verify:
+                    self.config["verify"] = self.verify
+                if self.delta is not None:
+                    self.config["delta"] = self.delta
+                if not self.config.get("delta") or self.config.get("clear_records"):
+                    # nothing is left to remove after clear
+                    self.config["delta"] = False
+                if self.config.get("verify") not in ["optimistic", "full"]:
+                    self.config["verify"] = "optimistic"
             except Exception as e:
                 logger.error(f"Error reading configuration file {config_file} with {e}")
                 sys.exit(1)
@@ -676,5 +1385,37 @@ class Client:
             sys.exit(1)
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Import douban csv to trakt")
+    parser.add_argument(
+        "--verify",
+        choices=["optimistic", "full"],
+        help='"optimistic" trusts the responses of trakt, "full" downloads the remote lists again after changes',
+    )
+    parser.add_argument(
+        "--plan",
+        nargs="?",
+        const=WorkingDir.get_output("plan.json", False),
+        metavar="FILE",
+        help="only write the requests to send to FILE (default output/plan.json), nothing is changed on trakt",
+    )
+    parser.add_argument("--apply", metavar="FILE", help="send the requests of a plan as they are, without comparing again")
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        default=None,
+        help="also remove the records not on douban any more from trakt, and update changed ratings",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="run the phases one after another with cProfile and tracemalloc, and write the profiles to output/profiles/",
+    )
+    args = parser.parse_args()
+    if args.plan and args.apply:
+        parser.error("--plan and --apply can not be used together")
+    Client(args.verify, args.delta, args.plan, args.apply, args.profile).run()
+
+
 if __name__ == "__main__":
-    Client().run()
+    main()
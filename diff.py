@@ -0,0 +1,34 @@
+from collections import namedtuple
+
+Diff = namedtuple("Diff", ["to_add", "present", "invalid", "to_remove"])
+
+
+def diff(local_items, remote_items, local_key, remote_key, validate=None):
+    """
+    Diff local items against remote items in one pass over each side, the keys of both sides
+    are computed once and must be comparable, e.g. LocalItem.index_key and TraktItem.index_key.
+    Remote items are either a list or a dict of key -> item indexed before
+    """
+    remote = remote_items if isinstance(remote_items, dict) else index_by(remote_items, remote_key)
+    to_add, present, invalid = [], [], []
+    seen = set()
+    for item in local_items:
+        if validate and not validate(item):
+            invalid.append(item)
+            continue
+        key = local_key(item)
+        seen.add(key)
+        if key in remote:
+            present.append(item)
+        else:
+            to_add.append(item)
+    to_remove = [item for key, item in remote.items() if key not in seen]
+    return Diff(to_add, present, invalid, to_remove)
+
+
+def index_by(items, key):
+    """
+    Items without a key (None) are left out
+    """
+    keyed = ((key(x), x) for x in items)
+    return dict((k, x) for k, x in keyed if k is not None)
@@ -0,0 +1,117 @@
+import re
+
+from lxml import html
+
+from logger import logger
+
+_IMDB_PATTERN = re.compile(r"IMDb:?\s*</span>\s*(tt\d+)")
+
+
+def _has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+
+_ITEMS_XPATH = "//div[{}]".format(_has_class("item"))
+_TITLE_XPATH = ".//li[{}]//em".format(_has_class("title"))
+_DATE_XPATH = ".//span[{}]".format(_has_class("date"))
+_COMMENT_XPATH = ".//span[{}]".format(_has_class("comment"))
+_PAGINATOR_LINKS_XPATH = "//div[{}]//a".format(_has_class("paginator"))
+_SUBJECT_NUM_XPATH = "//span[{}]".format(_has_class("subject-num"))
+_USER_NAME_XPATH = "//div[{}]".format(_has_class("name"))
+
+
+def _parse(text):
+    return html.fromstring(text) if text and text.strip() else None
+
+
+def parse_items(text):
+    """
+    Parse items of a grid page, each item is a dict of link, title, rating, comment and date.
+    An item not in the expected layout is logged and skipped, the rest of the page is kept
+    """
+    tree = _parse(text)
+    if tree is None:
+        return []
+
+    items = []
+    for dom_item in tree.xpath(_ITEMS_XPATH):
+        try:
+            items.append(_parse_item(dom_item))
+        except (StopIteration, IndexError, ValueError) as e:
+            logger.warning("Skip an item not parsed, {}: {}".format(repr(e), " ".join(dom_item.text_content().split())[:100]))
+    return items
+
+
+def _parse_item(dom_item):
+    link = next(dom_item.iter("a")).get("href")
+
+    title = dom_item.xpath(_TITLE_XPATH)
+    date = dom_item.xpath(_DATE_XPATH)
+    comment = dom_item.xpath(_COMMENT_XPATH)
+
+    # rating is the span before date, with class like "rating5-t"
+    rating = date[0].getprevious() if date else None
+    rating_class = rating.get("class", "").split() if rating is not None else None
+
+    return {
+        "link": link,
+        "title": title[0].text_content() if title else None,
+        "rating": int(rating_class[0][6]) if rating_class else None,
+        "comment": (comment[0].text or "").strip() if comment else None,
+        "date": (date[0].text or "").strip() if date else None,
+    }
+
+
+def parse_max(text):
+    """
+    Parse the max page number and the total count of a grid page
+    """
+    tree = _parse(text)
+    if tree is None:
+        return 1, 0
+
+    links = tree.xpath(_PAGINATOR_LINKS_XPATH)
+    max_page = links[-2].text_content() if len(links) > 1 else 1
+
+    subject_num = tree.xpath(_SUBJECT_NUM_XPATH)
+    total_count = subject_num[0].text_content().split("/")[1].strip() if subject_num else 0
+
+    return int(max_page), int(total_count)
+
+
+def parse_imdb_id(text):
+    """
+    Parse imdb id of a subject page, return None if not found
+    """
+    if not text:
+        return None
+
+    # fast path, the imdb id is the text right after span "IMDb:"
+    match = _IMDB_PATTERN.search(text)
+    if match:
+        return match.group(1)
+
+    tree = _parse(text)
+    info_area = tree.get_element_by_id("info", None) if tree is not None else None
+    if info_area is not None:
+        for span in reversed(list(info_area.iter("span"))):
+            imdb_id = (span.tail or "").strip()
+            if imdb_id.startswith("tt"):
+                return imdb_id
+    return None
+
+
+def parse_user_name(text):
+    """
+    Parse name of the user page, return None if the request is blocked or the user not exists
+    """
+    tree = _parse(text)
+    if tree is None:
+        return None
+
+    content = tree.text_content()
+    if "异常请求" in content or tree.find(".//title") is not None and "404" in content:
+        return None
+
+    name = tree.xpath(_USER_NAME_XPATH)
+    return name[0].text_content().strip() if name else None
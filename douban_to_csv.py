@@ -5,167 +5,279 @@
 # License:  GNU General Public License version 3 or later; see LICENSE.txt
 # Website:  https://douban.com, https://github.com/xlfu-cc/douban-to-trakt.git
 #
+import argparse
 import csv
 import os
 import sys
 import time
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import yaml
-from bs4 import BeautifulSoup
 
+from cache import FileCache
+from douban_parser import parse_imdb_id, parse_items, parse_max, parse_user_name
 from file import WorkingDir
+from http_client import http
+from journal import Journal, journal_file
 from logger import logger
+from metrics import metrics
+from profiler import Profiler
+from throttle import TokenBucket
 
 _config = {}
 _headers = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"}
 _cookies = {}
+_limiter = None
+_page_cache = None
+_profiler = None
+
+
+def is_blocked(response):
+    return response.status_code == 403 or "异常请求" in response.text
 
 
 def requests_get(url, params=None, **kwargs):
-    time.sleep(_config["sleep_interval"])
-    return requests.get(url, params=params, **kwargs)
+    """
+    Get with the shared rate limiter, back off and retry when douban blocks the request
+    """
+    max_retries = _config["max_retries"]
+    endpoint = metrics.endpoint("GET", url)
+    for attempt in range(max_retries + 1):
+        start = time.monotonic()
+        _limiter.acquire()
+        metrics.sleep(endpoint, time.monotonic() - start)
+        r = http.get(url, params=params, **kwargs)
+        if not is_blocked(r):
+            _limiter.success()
+            return r
+        if attempt < max_retries:
+            metrics.retry(endpoint)
+            pause = _limiter.backoff(attempt + 1)
+            logger.warning(f"    Blocked by douban(code: {r.status_code}) for {url}, retry #{attempt + 1} after {pause}s")
+    return r
+
+
+class DetailFetcher:
+    """
+    Fetch imdb ids from detail pages in a bounded worker pool, so grid pages keep scraping in the meanwhile
+    """
+
+    def __init__(self, workers, journal=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="douban-detail")
+        self.journal = journal
+        self.futures = []
+
+    def submit(self, item, link, title):
+        def fetch():
+            item["imdb_id"] = get_imdb_id(link, title)
+            logger.debug(f'    Get item "{title}" with imdb: "{item["imdb_id"]}"')
+            if self.journal:
+                self.journal.append(dict(item))
+
+        self.futures.append(self.executor.submit(metrics.bind(fetch)))
+
+    def wait(self):
+        for future in self.futures:
+            # exception() blocks until the future is done
+            if future.exception():
+                logger.error(f"    Error occurred when fetching imdb id, e: {future.exception()}")
+        self.futures = []
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_subject_page(url, title):
+    """
+    Get subject page from the local cache keyed by douban id, download and cache it on miss.
+    In offline mode, expired pages are still used and missed pages are skipped.
+    """
+    douban_id = url.split("/")[-2]
+    offline = _config["offline"]
+    text = _page_cache.get(douban_id, allow_expired=offline) if _page_cache else None
+    if text is None:
+        if offline:
+            logger.warning(f'    Subject page of "{title}" is not cached, skipped in offline mode, {url}')
+            return None
+        r = requests_get(url, headers=_headers, cookies=_cookies)
+        text = r.text
+        if _page_cache and r.ok and not is_blocked(r):
+            _page_cache.put(douban_id, text)
+    return text
 
 
 def get_imdb_id(url, title):
-    r = requests_get(url, headers=_headers, cookies=_cookies)
-    soup = BeautifulSoup(r.text, "lxml")
-    info_area = soup.find(id="info")
-    imdb_id = None
-    try:
-        if info_area:
-            for index in range(-1, -len(info_area.find_all("span")) + 1, -1):
-                imdb_id = info_area.find_all("span")[index].next_sibling.strip()
-                if imdb_id.startswith("tt"):
-                    break
-        else:
-            logger.error(f'    Can not find imdb info for "{title}", {url}')
-    except Exception as e:
-        logger.error(f'    Can not find imdb info for "{title}", {url}, e: {e}')
-    finally:
-        return imdb_id if imdb_id and imdb_id.startswith("tt") else None
+    text = get_subject_page(url, title)
+    if text is None:
+        return None
+    imdb_id = parse_imdb_id(text)
+    if not imdb_id:
+        logger.error(f'    Can not find imdb info for "{title}", {url}')
+    return imdb_id
+
+
+def _snapshot(item):
+    """
+    Fields compared by incremental scrape, values loaded from csv are strings
+    """
+    return tuple("" if item.get(x) is None else str(item.get(x)) for x in ["type", "rating", "comment", "date"])
 
 
-def scrape_page(user_id, collect_type, start, result):
+def scrape_page(user_id, collect_type, start, result, fetcher=None, journal=None):
+    """
+    Scrape one grid page into result, return the count of new or changed items, None if the page failed.
+    Items still without imdb id count as changed, so that their lookup is retried.
+    Changed items are appended to journal once their imdb id is known.
+    """
     logger.info(f"  Scrape with start={start}...")
-    url = "https://movie.douban.com/people/{}/{}?start={}&sort=time&rating=all&filter=all&mode=grid".format(user_id, collect_type, start)
+    url = "{}/people/{}/{}?start={}&sort=time&rating=all&filter=all&mode=grid".format(_config["movie_url"], user_id, collect_type, start)
     r = requests_get(url, headers=_headers)
-    soup = BeautifulSoup(r.text, "lxml")
-    dom_items = soup.find_all("div", {"class": "item"})
+    dom_items = parse_items(r.text)
 
     if dom_items and len(dom_items) > 0:
         logger.debug(f"    Get {len(dom_items)} items")
+        changed = 0
         for dom_item in dom_items:
+            title = dom_item["title"]
+            link = dom_item["link"]
             try:
-                link = dom_item.a["href"]
                 douban_id = link.split("/")[-2]
 
                 item = result.get(douban_id)
                 if not item:
                     item = {"douban_id": douban_id}
                     result[douban_id] = item
+                previous = _snapshot(item) if len(item) > 1 else None
 
                 item["type"] = collect_type
 
-                title = dom_item.find("li", {"class": "title"}).em.text
                 item["title"] = title
-
-                rating = dom_item.find("span", {"class": "date"}).find_previous_siblings()
-                item["rating"] = int(rating[0]["class"][0][6]) if len(rating) > 0 else None
-
-                comment = dom_item.find("span", {"class": "comment"})
-                item["comment"] = comment.contents[0].strip() if comment else None
-
-                date = dom_item.find("span", {"class": "date"})
-                item["date"] = date.contents[0].strip() if date else None
-
-                if not item.get("imdb_id"):
+                item["rating"] = dom_item["rating"]
+                item["comment"] = dom_item["comment"]
+                item["date"] = dom_item["date"]
+
+                fetching = False
+                if item.get("imdb_id"):
+                    logger.debug(f'    Get item "{title}" with imdb: "{item["imdb_id"]}"')
+                elif fetcher:
+                    item["imdb_id"] = None
+                    fetcher.submit(item, link, title)
+                    fetching = True
+                else:
                     item["imdb_id"] = get_imdb_id(link, title)
-                logger.debug(f'    Get item "{title}" with imdb: "{item["imdb_id"]}"')
+                    logger.debug(f'    Get item "{title}" with imdb: "{item["imdb_id"]}"')
+
+                if previous != _snapshot(item) or not item["imdb_id"]:
+                    changed += 1
+                    if journal and not fetching:
+                        journal.append(dict(item))
             except Exception as e:
+                changed += 1
                 logger.error(f'    Error occurred when scraping for "{title}", {link}, e: {e}')
+        return changed
     else:
         logger.error("  Scrape with start={} failed, response: {}".format(start, r))
+        return None
+
+
+def count_typed(data_map, collect_type):
+    return len([x for x in data_map.values() if x.get("type") == collect_type])
 
 
 def get_max(user_id, collect_type):
     r = requests_get(
-        "https://movie.douban.com/people/{}/{}".format(user_id, collect_type),
+        "{}/people/{}/{}".format(_config["movie_url"], user_id, collect_type),
         headers=_headers,
     )
-    soup = BeautifulSoup(r.text, "lxml")
-
-    paginator = soup.find("div", {"class": "paginator"})
-    max_page = paginator.find_all("a")[-2].get_text() if paginator else 1
-
-    subject_sum = soup.find("span", {"class": "subject-num"})
-    total_count = subject_sum.get_text().split("/")[1].strip() if subject_sum else 0
-
-    return int(max_page), int(total_count)
+    return parse_max(r.text)
 
 
 def load_previous(file_name):
     """
-    Load data from file_name, for multi-pass scrape, read in previous scraped movie results
+    Load data from file_name, for multi-pass scrape, read in previous scraped movie results,
+    then replay the journal left by an interrupted scrape on top of them
     """
+    result = {}
     if os.path.exists(file_name):
         with open(file_name, "r", encoding="utf-8") as f:
             result = dict([(x["douban_id"], x) for x in csv.DictReader(f)])
 
-            logger.debug(
-                "{} items loaded, collect: {}, wish: {}".format(
-                    len(result.keys()),
-                    len(list(filter(lambda x: x["type"] == "collect", result.values()))),
-                    len(list(filter(lambda x: x["type"] == "wish", result.values()))),
-                )
+    replayed = Journal(journal_file(file_name)).replay()
+    for record in replayed:
+        result.setdefault(record["douban_id"], {}).update(record)
+
+    if result:
+        logger.debug(
+            "{} items loaded, {} replayed from journal, collect: {}, wish: {}".format(
+                len(result.keys()),
+                len(replayed),
+                len(list(filter(lambda x: x["type"] == "collect", result.values()))),
+                len(list(filter(lambda x: x["type"] == "wish", result.values()))),
             )
-            return result
-    return {}
+        )
+    return result
 
 
-def scrape(user_id, name, file_name):
-    logger.info('Scrape for "{}"...'.format(name))
+def scrape(user_id, name, file_name, full_scan=False):
+    """
+    Scrape "collect" and "wish" of the user, pages are sorted by time, so unless full_scan,
+    stop paging at the first page without any new or changed item
+    """
+    logger.info('Scrape for "{}"{}...'.format(name, " (full scan)" if full_scan else ""))
 
     logger.debug("Load previous scraped movies from {}".format(file_name))
     data_map = load_previous(file_name)
 
+    journal = Journal(journal_file(file_name))
+    fetcher = None
     types = ["collect", "wish"]
     total_count = 0
-    for collect_type in types:
-        logger.info('Scraping "{}"...'.format(collect_type))
-
-        max_page, count = get_max(user_id, collect_type)
-        total_count += count
-        logger.info('  "{}" has total {} pages, {} items'.format(collect_type, max_page, count))
-
-        for page in range(max_page):
-            try:
-                scrape_page(user_id, collect_type, page * 15, data_map)
-            except Exception as e:
-                logger.error("Error occurred when scraping with error {}".format(e))
-            write_to_csv(
-                file_name,
-                sorted(
-                    data_map.values(),
-                    key=lambda x: (
-                        1 if "imdb_id" in x and x["imdb_id"] else 0,
-                        x["type"],
-                        x["date"] if "date" in x else "",
-                        x["douban_id"],
-                    ),
-                    reverse=True,
-                ),
-            )
-
-        typed = list(filter(lambda x: x["type"] == collect_type, data_map.values()))
-        logger.info(
-            'Scrape "{type}" finished, success: {success}, imdb failed: {imdb_failed}, total(actual/expect): {actual}/{expect}\n'.format(
-                type=collect_type,
-                success=len(list(filter(lambda x: x["imdb_id"], typed))),
-                imdb_failed=len(list(filter(lambda x: not x["imdb_id"], typed))),
-                actual=len(typed),
-                expect=count,
+    try:
+        for collect_type in types:
+            logger.info('Scraping "{}"...'.format(collect_type))
+
+            phase = f"scrape {collect_type}"
+            with metrics.phase(phase), _profiler.phase(phase) if _profiler else nullcontext():
+                # a pool per type, its threads belong to the phase
+                fetcher = DetailFetcher(_config["workers"], journal)
+                max_page, count = get_max(user_id, collect_type)
+                total_count += count
+                logger.info('  "{}" has total {} pages, {} items'.format(collect_type, max_page, count))
+
+                for page in range(max_page):
+                    changed = None
+                    try:
+                        changed = scrape_page(user_id, collect_type, page * 15, data_map, fetcher, journal)
+                    except Exception as e:
+                        logger.error("Error occurred when scraping with error {}".format(e))
+                    # an interrupted scrape leaves the later pages unknown, so all items must be known as well
+                    if not full_scan and changed == 0 and count_typed(data_map, collect_type) >= count:
+                        logger.info(f'  No changes on page {page + 1}, skip the remaining {max_page - page - 1} pages of "{collect_type}"')
+                        break
+
+                # imdb ids of the last pages are still fetching in background
+                fetcher.wait()
+                fetcher.shutdown()
+
+            typed = list(filter(lambda x: x["type"] == collect_type, data_map.values()))
+            logger.info(
+                'Scrape "{type}" finished, success: {success}, imdb failed: {imdb_failed}, total(actual/expect): {actual}/{expect}\n'.format(
+                    type=collect_type,
+                    success=len(list(filter(lambda x: x["imdb_id"], typed))),
+                    imdb_failed=len(list(filter(lambda x: not x["imdb_id"], typed))),
+                    actual=len(typed),
+                    expect=count,
+                )
             )
-        )
+    finally:
+        # compact the journal into the sorted csv, also on interrupt
+        if fetcher:
+            fetcher.shutdown()
+        if data_map:
+            write_sorted_to_csv(file_name, data_map)
+        journal.clear()
+        if _page_cache and not _config["offline"]:
+            _page_cache.evict()
 
     imdb_failed = list(filter(lambda x: not x["imdb_id"], data_map.values()))
     if imdb_failed:
@@ -181,15 +293,11 @@ def scrape(user_id, name, file_name):
 
 
 def check_user_exist(user_id):
-    r = requests_get("https://m.douban.com/people/{}/".format(user_id), headers=_headers)
-    soup = BeautifulSoup(r.text, "lxml")
-    if "异常请求" in soup.text or soup.title is not None and "404" in soup.text:
-        logger.error(soup.text)
-        name = None
-    else:
-        name = soup.find("div", {"class": "name"}).text.strip()
-
+    r = requests_get("{}/people/{}/".format(_config["mobile_url"], user_id), headers=_headers)
+    name = parse_user_name(r.text)
     if name is None:
+        if is_blocked(r):
+            logger.error(f"Request blocked by douban, code: {r.status_code}")
         logger.error(f"Douban user id {user_id} not exists")
         sys.exit(1)
 
@@ -214,11 +322,55 @@ def init_config(config_file):
         key, value = cookie.split("=", 1)
         _cookies[key] = value
 
-    if not _config.get("sleep_interval"):
-        _config["sleep_interval"] = 2
+    if not _config.get("requests_per_second"):
+        # fall back to the legacy fixed interval between requests
+        _config["requests_per_second"] = 1 / _config["sleep_interval"] if _config.get("sleep_interval") else 1
+    if not _config.get("burst"):
+        _config["burst"] = 3
+    if not _config.get("workers"):
+        _config["workers"] = 4
+    if _config.get("max_retries") is None:
+        _config["max_retries"] = 3
+    if not _config.get("full_scan"):
+        _config["full_scan"] = False
+    if not _config.get("offline"):
+        _config["offline"] = False
+    if _config.get("cache_ttl_days") is None:
+        _config["cache_ttl_days"] = 90
+    if _config.get("cache_max_mb") is None:
+        _config["cache_max_mb"] = 500
+    if _config.get("backoff_seconds") is None:
+        _config["backoff_seconds"] = 30
+    # e.g. a local replay server of recorded pages
+    _config["movie_url"] = (_config.get("movie_url") or "https://movie.douban.com").rstrip("/")
+    _config["mobile_url"] = (_config.get("mobile_url") or "https://m.douban.com").rstrip("/")
+
+    global _limiter, _page_cache
+    _limiter = TokenBucket(_config["requests_per_second"], _config["burst"], backoff_seconds=_config["backoff_seconds"])
+    _page_cache = FileCache(
+        WorkingDir.get_output("cache/subjects"),
+        ttl=_config["cache_ttl_days"] * 24 * 3600,
+        max_bytes=_config["cache_max_mb"] * 1024 * 1024,
+    )
     return _config
 
 
+def write_sorted_to_csv(file_name, data_map):
+    write_to_csv(
+        file_name,
+        sorted(
+            data_map.values(),
+            key=lambda x: (
+                1 if "imdb_id" in x and x["imdb_id"] else 0,
+                x["type"],
+                x["date"] if "date" in x else "",
+                x["douban_id"],
+            ),
+            reverse=True,
+        ),
+    )
+
+
 def write_to_csv(file_name, items):
     with open(file_name, "w", encoding="utf-8") as f:
         writer = csv.DictWriter(f, items[0].keys())
@@ -227,15 +379,36 @@ def write_to_csv(file_name, items):
         logger.info(f"Data exported to {file_name}")
 
 
-def main():
+def run(full_scan=False, profile=False):
     config_file = WorkingDir.get("config.yaml")
     config = init_config(config_file)
 
     user_id = config["user_id"]
     name = check_user_exist(user_id)
 
+    if profile:
+        global _profiler
+        _profiler = Profiler(WorkingDir.get_output("profiles/douban-{}".format(time.strftime("%Y%m%d-%H%M%S"))))
+
     file_name = WorkingDir.get_output("douban.csv")
-    scrape(user_id, name, file_name)
+    try:
+        scrape(user_id, name, file_name, full_scan or config["full_scan"])
+    finally:
+        http.log_stats()
+        metrics.log_summary()
+        metrics.save(WorkingDir.get_output("douban_metrics.json"))
+        if config.get("metrics_textfile"):
+            metrics.save_prometheus(config["metrics_textfile"], "scrape")
+        if _profiler:
+            _profiler.save_report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export douban movie records to csv")
+    parser.add_argument("--full", action="store_true", help="scrape all pages instead of stopping at the first unchanged page")
+    parser.add_argument("--profile", action="store_true", help="profile the scrape with cProfile and tracemalloc, and write the profiles to output/profiles/")
+    args = parser.parse_args()
+    run(args.full, args.profile)
 
 
 if __name__ == "__main__":
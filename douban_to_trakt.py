@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2023-2023 xlfu.cc <xlfu.cc@gmail.com>. All Rights Reserved.
+# License:  GNU General Public License version 3 or later; see LICENSE.txt
+# Website:  https://github.com/xlfu-cc/douban-to-trakt.git
+#
+# Single entry point of douban-to-trakt, the scrape, resolve, sync, plan and status commands.
+# Heavy dependencies (requests, lxml, trakt.py, tqdm) are imported by the commands needing
+# them only, so that status and --help start fast, e.g. from cron or a frozen build.
+#
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from file import WorkingDir
+from id_store import IdStore
+from journal import Journal, journal_file
+from logger import logger
+
+
+def scrape(args):
+    import douban_to_csv
+
+    douban_to_csv.run(args.full, args.profile)
+
+
+def resolve(args):
+    from csv_to_trakt import Client
+
+    Client(profile=args.profile).resolve()
+
+
+def sync(args):
+    from csv_to_trakt import Client
+
+    Client(args.verify, args.delta, None, args.apply, args.profile).run()
+
+
+def plan(args):
+    from csv_to_trakt import Client
+
+    Client(args.verify, args.delta, args.file, None, args.profile).run()
+
+
+def status(args):
+    """
+    Show the configuration and the local state of the last runs, nothing is requested
+    """
+    import yaml
+
+    config_file = WorkingDir.get("config.yaml")
+    if not os.path.exists(config_file):
+        logger.error(f"Configuration file {config_file} not exists")
+        sys.exit(1)
+    with open(config_file, "r") as yaml_file:
+        config = yaml.load(yaml_file, Loader=yaml.FullLoader) or {}
+    required = {"douban": ["user_id", "cookies"], "trakt": ["client_id", "client_secret", "redirect_uri"]}
+    for section, keys in required.items():
+        missing = [x for x in keys if not (config.get(section) or {}).get(x)]
+        logger.info("config {}: {}".format(section, "missing " + ", ".join(missing) if missing else "ok"))
+
+    auth_file = WorkingDir.get(".trakt_auth")
+    if os.path.exists(auth_file):
+        with open(auth_file, "r") as f:
+            auth = yaml.load(f, yaml.FullLoader) or {}
+        expires_at = auth.get("created_at", 0) + auth.get("expires_in", 0)
+        logger.info("trakt token: expires at {}".format(time.strftime("%Y-%m-%d %H:%M", time.localtime(expires_at))))
+    else:
+        logger.info("trakt token: not authorized yet")
+
+    csv_file = WorkingDir.get_output("douban.csv", False)
+    if os.path.exists(csv_file):
+        with open(csv_file, "r", encoding="utf-8") as f:
+            items = list(csv.DictReader(f))
+        logger.info(
+            "douban.csv: {} items, collect: {}, wish: {}, without imdb id: {}, without trakt id: {}".format(
+                len(items),
+                len([x for x in items if x["type"] == "collect"]),
+                len([x for x in items if x["type"] == "wish"]),
+                len([x for x in items if not x.get("imdb_id")]),
+                len([x for x in items if not x.get("trakt_id")]),
+            )
+        )
+    else:
+        logger.info("douban.csv: not scraped yet")
+
+    pending = Journal(journal_file(csv_file)).replay()
+    if pending:
+        logger.info(f"douban.csv: {len(pending)} records of an interrupted scrape, compacted by the next scrape")
+
+    id_file = WorkingDir.get_output("trakt_ids.db", False)
+    if os.path.exists(id_file):
+        store = IdStore(id_file)
+        found, failed = store.counts()
+        store.close()
+        logger.info(f"id store: {found} imdb ids resolved, {failed} not found")
+
+    comments = Journal(WorkingDir.get_output("trakt_comments.jsonl", False)).replay()
+    if comments:
+        # item key -> comment id, like the replay of csv_to_trakt
+        posted = dict((x["key"], x["id"]) for x in comments if "deleted" not in x)
+        deleted = set(x["deleted"] for x in comments if "deleted" in x)
+        logger.info("comments: {} posted".format(len([x for x in posted.values() if x not in deleted])))
+
+    plan_file = WorkingDir.get_output("plan.json", False)
+    if os.path.exists(plan_file):
+        with open(plan_file, "r", encoding="utf-8") as f:
+            content = json.load(f)
+        logger.info("plan: {} requests, created at {}".format(content["summary"]["total_requests"], content.get("created_at")))
+
+    for name in ["douban_metrics.json", "trakt_metrics.json"]:
+        metrics_file = WorkingDir.get_output(name, False)
+        if os.path.exists(metrics_file):
+            with open(metrics_file, "r", encoding="utf-8") as f:
+                summary = json.load(f)
+            logger.info(
+                "last {}: started at {}, {:.0f}s, {} requests".format(
+                    name.split("_")[0], summary["started_at"], summary["wall_seconds"], sum(x["requests"] for x in summary["phases"].values())
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="douban-to-trakt", description="Export douban movie records and import them to trakt")
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    command = commands.add_parser("scrape", help="export douban records to output/douban.csv")
+    command.add_argument("--full", action="store_true", help="scrape all pages instead of stopping at the first unchanged page")
+    command.set_defaults(func=scrape)
+
+    command = commands.add_parser("resolve", help="only resolve the trakt ids of output/douban.csv")
+    command.set_defaults(func=resolve)
+
+    for name, help in [("sync", "import output/douban.csv to trakt"), ("plan", "only write the requests of a sync to a file")]:
+        command = commands.add_parser(name, help=help)
+        command.add_argument(
+            "--verify",
+            choices=["optimistic", "full"],
+            help='"optimistic" trusts the responses of trakt, "full" downloads the remote lists again after changes',
+        )
+        command.add_argument(
+            "--delta",
+            action="store_true",
+            default=None,
+            help="also remove the records not on douban any more from trakt, and update changed ratings",
+        )
+        if name == "sync":
+            command.add_argument("--apply", metavar="FILE", help="send the requests of a plan as they are, without comparing again")
+            command.set_defaults(func=sync)
+        else:
+            command.add_argument("file", nargs="?", default=WorkingDir.get_output("plan.json", False), help="default output/plan.json")
+            command.set_defaults(func=plan)
+
+    for name in ["scrape", "resolve", "sync", "plan"]:
+        commands.choices[name].add_argument(
+            "--profile", action="store_true", help="profile the phases with cProfile and tracemalloc, and write the profiles to output/profiles/"
+        )
+
+    command = commands.add_parser("status", help="show the configuration and the local state, nothing is requested")
+    command.set_defaults(func=status)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,19 @@ import sys
 import os
 
 class WorkingDir:
+    # overrides the directory of the script, e.g. for benchmarks
+    work_dir = None
+
+    @classmethod
+    def set(cls, work_dir):
+        cls.work_dir = work_dir
+
     @classmethod
     def get(cls, name, ensure_parent = False):
         work_dir = ""
-        if getattr(sys, "frozen", False):
+        if cls.work_dir:
+            work_dir = cls.work_dir
+        elif getattr(sys, "frozen", False):
             work_dir = os.path.dirname(sys.executable)
         elif __file__:
             work_dir = os.path.dirname(__file__)
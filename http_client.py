@@ -0,0 +1,152 @@
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from logger import logger
+from metrics import metrics
+
+
+class _Retry(Retry):
+    """
+    Retry 429 for every method, 5xx only for idempotent methods, since a failed POST may have been applied
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429 and self.total:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+class _ThrottledRetry(_Retry):
+    """
+    Retry of a throttled host, 429 is left to _ThrottledAdapter so that the limiter sees every one of them
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    return len(body.encode("utf-8")) if isinstance(body, str) else len(body) if isinstance(body, bytes) else 0
+
+
+class _ThrottledAdapter(HTTPAdapter):
+    """
+    Adapter of a throttled host, passing every request through its limiter, which waits in acquire()
+    before sending and learns from the response in update(). A 429 is sent again after the limiter
+    has seen it, at most max_retries.total times. Without a throttle it only records the metrics
+    """
+
+    def __init__(self, throttle=None, **kwargs):
+        super().__init__(**kwargs)
+        self.throttle = throttle
+
+    def send(self, request, **kwargs):
+        endpoint = metrics.endpoint(request.method, request.url)
+        if not self.throttle:
+            return self._send(endpoint, request, **kwargs)
+        attempt = 0
+        while True:
+            metrics.sleep(endpoint, self.throttle.acquire(request.method))
+            response = self._send(endpoint, request, **kwargs)
+            self.throttle.update(request.method, response)
+            if response.status_code != 429 or attempt >= (self.max_retries.total or 0):
+                return response
+            attempt += 1
+            metrics.retry(endpoint)
+            # release the connection before sending again
+            response.content
+            logger.debug(f"Rate limited: {request.method} {request.url}, send again")
+
+    def _send(self, endpoint, request, **kwargs):
+        start = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            metrics.request(endpoint, "error", time.monotonic() - start, _body_size(request.body))
+            raise
+        retries = response.raw.retries.history if getattr(response.raw, "retries", None) else ()
+        received = response.headers.get("Content-Length")
+        if received is None and not kwargs.get("stream"):
+            received = len(response.content)
+        metrics.request(endpoint, response.status_code, time.monotonic() - start, _body_size(request.body), int(received or 0), len(retries))
+        return response
+
+
+class HttpClient:
+    """
+    Shared HTTP client of douban and trakt, a single session with keep-alive connection pools per host,
+    gzip, and retries with backoff on 429 and 5xx, honouring "Retry-After"
+    """
+
+    def __init__(self, retries=3, backoff_factor=1, pool_maxsize=16):
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_maxsize = pool_maxsize
+        self.adapter = _ThrottledAdapter(pool_connections=8, pool_maxsize=pool_maxsize, max_retries=self._retry(_Retry))
+        # host -> limiter
+        self.throttles = {}
+
+        self.session = requests.Session()
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def throttle(self, base_url, limiter):
+        """
+        Throttle all requests to the host of base_url with limiter, through an adapter of its own
+        """
+        parts = urlsplit(base_url)
+        self.throttles[parts.netloc] = limiter
+        adapter = _ThrottledAdapter(limiter, pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=self._retry(_ThrottledRetry))
+        self.session.mount(f"{parts.scheme}://{parts.netloc}/", adapter)
+
+    def _retry(self, retry_class):
+        return retry_class(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=[500, 502, 503, 504],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+
+    def get(self, url, params=None, **kwargs):
+        return self.session.get(url, params=params, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.session.post(url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.session.delete(url, **kwargs)
+
+    def stats(self):
+        """
+        Per host: requests sent, connections opened and the ratio of requests reusing a connection
+        """
+        result = {}
+        # a throttled host has its own adapter
+        pools = [x.poolmanager.pools for x in set(self.session.adapters.values())]
+        for pool in [x.get(key) for x in pools for key in list(x.keys())]:
+            if pool and pool.num_requests:
+                result[f"{pool.host}:{pool.port}"] = {
+                    "requests": pool.num_requests,
+                    "connections": pool.num_connections,
+                    "reuse": 1 - pool.num_connections / pool.num_requests,
+                }
+        return result
+
+    def log_stats(self):
+        for host, stats in self.stats().items():
+            logger.debug(
+                "Http {}: {} requests, {} connections, {:.0%} reused".format(host, stats["requests"], stats["connections"], stats["reuse"])
+            )
+
+
+http = HttpClient()
@@ -0,0 +1,84 @@
+import sqlite3
+import threading
+import time
+
+FIELDS = ["media_type", "trakt_id", "trakt_show_id", "season_number", "trakt_episode_ids", "candidates"]
+
+
+class IdStore:
+    """
+    Local sqlite store of imdb id -> trakt ids, shared across csv files and runs.
+    Failed searches are stored as well, and skipped until their retry time.
+    """
+
+    def __init__(self, file_name, retry_days=7):
+        self.retry_seconds = retry_days * 24 * 3600
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(file_name, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS ids ("
+                " imdb_id TEXT PRIMARY KEY, {}, found INTEGER NOT NULL, retry_after REAL, updated_at REAL NOT NULL"
+                ")".format(", ".join(f"{x} TEXT" for x in FIELDS))
+            )
+
+    def get(self, imdb_id):
+        """
+        Return the stored trakt info of imdb_id as a dict with "found" and "retry_after", None if unknown
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT {}, found, retry_after FROM ids WHERE imdb_id = ?".format(", ".join(FIELDS)), (imdb_id,)
+            ).fetchone()
+        if not row:
+            return None
+        info = dict(zip(FIELDS, row[: len(FIELDS)]))
+        info["found"] = bool(row[len(FIELDS)])
+        info["retry_after"] = row[len(FIELDS) + 1]
+        return info
+
+    def put(self, imdb_id, info):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ids (imdb_id, {}, found, retry_after, updated_at) VALUES (?, {}, 1, NULL, ?)".format(
+                    ", ".join(FIELDS), ", ".join("?" * len(FIELDS))
+                ),
+                [imdb_id] + [self._value(info.get(x)) for x in FIELDS] + [time.time()],
+            )
+
+    def put_many(self, infos):
+        """
+        Store resolved infos of (imdb_id, info) not stored yet
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO ids (imdb_id, {}, found, retry_after, updated_at) VALUES (?, {}, 1, NULL, ?)".format(
+                    ", ".join(FIELDS), ", ".join("?" * len(FIELDS))
+                ),
+                [[imdb_id] + [self._value(info.get(x)) for x in FIELDS] + [now] for imdb_id, info in infos],
+            )
+
+    def put_failure(self, imdb_id):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ids (imdb_id, found, retry_after, updated_at) VALUES (?, 0, ?, ?)",
+                (imdb_id, now + self.retry_seconds, now),
+            )
+
+    def counts(self):
+        """
+        Return the numbers of found and failed imdb ids
+        """
+        with self.lock:
+            rows = dict(self.conn.execute("SELECT found, COUNT(*) FROM ids GROUP BY found").fetchall())
+        return rows.get(1, 0), rows.get(0, 0)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    @staticmethod
+    def _value(value):
+        return None if value is None or value == "" else str(value)
@@ -0,0 +1,56 @@
+import json
+import os
+import threading
+
+from logger import logger
+
+
+class Journal:
+    """
+    Append-only journal in json lines, one record per line, flushed as soon as it is written.
+    Replayed on restart and cleared once the records are compacted into the final file.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = None
+        self.lock = threading.Lock()
+
+    def replay(self):
+        records = []
+        if os.path.exists(self.file_name):
+            with open(self.file_name, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # the last line may be cut by a crash
+                        logger.warning(f"Skip broken journal line in {self.file_name}: {line.strip()}")
+        return records
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            if not self.file:
+                self.file = open(self.file_name, "a", encoding="utf-8")
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def clear(self):
+        with self.lock:
+            self._close()
+            if os.path.exists(self.file_name):
+                os.remove(self.file_name)
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def journal_file(file_name):
+    return "{}.journal.jsonl".format(os.path.splitext(file_name)[0])
@@ -1,25 +1,37 @@
 import logging
 
-import colorlog
+
+class _ColoredHandler(logging.StreamHandler):
+    """
+    StreamHandler with the colorlog formatter, colorlog is imported by the first record logged,
+    so that importing logger stays cheap for the commands not logging anything, e.g. --help
+    """
+
+    def format(self, record):
+        if self.formatter is None:
+            import colorlog
+
+            self.setFormatter(
+                colorlog.ColoredFormatter(
+                    "%(log_color)s%(name)s %(asctime)s %(levelname)8s %(message)s",
+                    datefmt="%Y-%d-%d %H:%M:%S",
+                    log_colors={
+                        "DEBUG": "cyan",
+                        "INFO": "green",
+                        "SUCCESS:": "white",
+                        "WARNING": "yellow",
+                        "ERROR": "red",
+                        "CRITICAL": "red,bg_white",
+                    },
+                )
+            )
+        return super().format(record)
+
 
 # log setup for douban-to-trakt
 logger = logging.getLogger("douban-to-trakt")
 logger.setLevel(logging.DEBUG)
 
-handler = logging.StreamHandler()
+handler = _ColoredHandler()
 handler.setLevel(logging.DEBUG)
-handler.setFormatter(
-    colorlog.ColoredFormatter(
-        "%(log_color)s%(name)s %(asctime)s %(levelname)8s %(message)s",
-        datefmt="%Y-%d-%d %H:%M:%S",
-        log_colors={
-            "DEBUG": "cyan",
-            "INFO": "green",
-            "SUCCESS:": "white",
-            "WARNING": "yellow",
-            "ERROR": "red",
-            "CRITICAL": "red,bg_white",
-        },
-    )
-)
 logger.addHandler(handler)
@@ -0,0 +1,202 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from logger import logger
+
+# upper bounds of the latency buckets in seconds, the last bucket is +Inf
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+_USER_PATTERN = re.compile(r"/(people|users)/[^/]+")
+_ID_PATTERN = re.compile(r"/[^/]*\d[^/]*(?=/|$)")
+
+
+class _Series:
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.statuses = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.throttle_seconds = 0.0
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "statuses": self.statuses,
+            "seconds": round(self.seconds, 3),
+            "mean_seconds": round(self.seconds / self.requests, 4) if self.requests else 0.0,
+            "max_seconds": round(self.max_seconds, 3),
+            "buckets": dict(zip([str(x) for x in BUCKETS] + ["+Inf"], self.buckets)),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "retries": self.retries,
+            "throttle_seconds": round(self.throttle_seconds, 3),
+        }
+
+
+class Metrics:
+    """
+    Request metrics per phase and endpoint: counts, latency histograms, bytes, retries, status codes
+    and throttle sleep. The phase is per thread, workers started inside a phase take it over with bind()
+    """
+
+    def __init__(self):
+        # (phase, endpoint) -> _Series
+        self.series = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        previous = self.current_phase()
+        self.local.phase = name
+        try:
+            yield
+        finally:
+            self.local.phase = previous
+
+    def current_phase(self):
+        return getattr(self.local, "phase", None)
+
+    def bind(self, func):
+        """
+        Wrap func to run in the phase of the caller, e.g. for tasks submitted to an executor
+        """
+        phase = self.current_phase()
+
+        def bound(*args, **kwargs):
+            with self.phase(phase):
+                return func(*args, **kwargs)
+
+        return bound
+
+    @staticmethod
+    def endpoint(method, url):
+        """
+        "GET host/path" with user names and ids replaced, e.g. "GET api.trakt.tv/search/imdb/:id"
+        """
+        parts = urlsplit(url)
+        path = _USER_PATTERN.sub(r"/\1/:user", parts.path.rstrip("/"))
+        return "{} {}{}".format(method, parts.netloc, _ID_PATTERN.sub("/:id", path))
+
+    def request(self, endpoint, status, seconds, bytes_sent=0, bytes_received=0, retries=0):
+        with self.lock:
+            series = self._series(endpoint)
+            series.requests += 1
+            series.seconds += seconds
+            series.max_seconds = max(series.max_seconds, seconds)
+            series.buckets[self._bucket(seconds)] += 1
+            series.statuses[str(status)] = series.statuses.get(str(status), 0) + 1
+            series.bytes_sent += bytes_sent
+            series.bytes_received += bytes_received
+            series.retries += retries
+
+    def retry(self, endpoint, count=1):
+        with self.lock:
+            self._series(endpoint).retries += count
+
+    def sleep(self, endpoint, seconds):
+        if seconds:
+            with self.lock:
+                self._series(endpoint).throttle_seconds += seconds
+
+    def summary(self):
+        with self.lock:
+            items = [(phase, endpoint, series.to_dict()) for (phase, endpoint), series in self.series.items()]
+        phases = {}
+        for phase, _, series in items:
+            total = phases.setdefault(phase or "-", {"requests": 0, "seconds": 0.0, "retries": 0, "throttle_seconds": 0.0})
+            for key in total:
+                total[key] += series[key]
+        return {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": round(time.time() - self.started, 3),
+            "phases": dict((k, dict((x, round(y, 3)) for x, y in v.items())) for k, v in phases.items()),
+            "endpoints": [dict(phase=phase or "-", endpoint=endpoint, **series) for phase, endpoint, series in sorted(items, key=lambda x: (x[0] or "", x[1]))],
+        }
+
+    def log_summary(self, top=10):
+        summary = self.summary()
+        if not summary["endpoints"]:
+            return
+        logger.info("Requests:")
+        for row in sorted(summary["endpoints"], key=lambda x: x["seconds"] + x["throttle_seconds"], reverse=True)[:top]:
+            logger.info(
+                "  {:<20}{:<45}{:>7}{:>9.1f}s{:>8.3f}s avg{:>8.1f}s throttled{:>5} retries".format(
+                    row["phase"], row["endpoint"], row["requests"], row["seconds"], row["mean_seconds"], row["throttle_seconds"], row["retries"]
+                )
+            )
+
+    def save(self, file_name):
+        with open(file_name, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def save_prometheus(self, file_name, job):
+        """
+        Write the metrics in the text format of the node exporter textfile collector, renamed into
+        place so that the collector never reads a partial file
+        """
+        with self.lock:
+            items = [(phase or "-", endpoint, series.to_dict()) for (phase, endpoint), series in self.series.items()]
+        lines = []
+
+        def add(name, kind, help, samples):
+            # samples of (suffix, labels, value), the suffix is for the series of a histogram
+            lines.append(f"# HELP douban_to_trakt_{name} {help}")
+            lines.append(f"# TYPE douban_to_trakt_{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append("douban_to_trakt_{}{}{{{}}} {}".format(name, suffix, ",".join('{}="{}"'.format(k, _escape(v)) for k, v in labels), value))
+
+        def labels(phase, endpoint, *extra):
+            return [("job", job), ("phase", phase), ("endpoint", endpoint)] + list(extra)
+
+        add("requests_total", "counter", "Requests sent", [("", labels(p, e, ("code", c)), n) for p, e, s in items for c, n in sorted(s["statuses"].items())])
+        latency = []
+        for p, e, s in items:
+            count = 0
+            for bound, n in s["buckets"].items():
+                count += n
+                latency.append(("_bucket", labels(p, e, ("le", bound)), count))
+            latency.append(("_sum", labels(p, e), s["seconds"]))
+            latency.append(("_count", labels(p, e), s["requests"]))
+        add("request_seconds", "histogram", "Latency of the requests", latency)
+        add("request_bytes_sent_total", "counter", "Bytes of request bodies", [("", labels(p, e), s["bytes_sent"]) for p, e, s in items])
+        add("request_bytes_received_total", "counter", "Bytes of responses", [("", labels(p, e), s["bytes_received"]) for p, e, s in items])
+        add("request_retries_total", "counter", "Requests sent again", [("", labels(p, e), s["retries"]) for p, e, s in items])
+        add("throttle_seconds_total", "counter", "Seconds slept by the rate limiters", [("", labels(p, e), s["throttle_seconds"]) for p, e, s in items])
+        add("last_run_timestamp_seconds", "gauge", "End of the last run", [("", [("job", job)], int(time.time()))])
+
+        temp = f"{file_name}.{os.getpid()}.tmp"
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp, file_name)
+
+    def _series(self, endpoint):
+        key = (self.current_phase(), endpoint)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = _Series()
+        return series
+
+    @staticmethod
+    def _bucket(seconds):
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                return index
+        return len(BUCKETS)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
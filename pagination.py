@@ -0,0 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+
+def iter_pages(get_page, workers=4):
+    """
+    Fetch page 1 to learn the page count, then the remaining pages concurrently, and yield
+    the items of every page in page order. get_page(page) returns (items, page count)
+    """
+    items, page_count = get_page(1)
+    yield from items
+    if page_count > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, page_count - 1), thread_name_prefix="page") as executor:
+            # map() keeps the order of the pages, whichever finishes first
+            for items, _ in executor.map(metrics.bind(get_page), range(2, page_count + 1)):
+                yield from items
+
+
+def page_count(response):
+    return int(response.headers.get("x-pagination-page-count") or 1)
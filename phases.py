@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from logger import logger
+from metrics import metrics
+
+
+class Phases:
+    """
+    Run independent phases (e.g. watchlist, watched, ratings and comments) concurrently and keep their timings.
+    A group of phases always runs to the end, the first error is raised once all of them are done.
+    """
+
+    def __init__(self, workers=4, profiler=None):
+        self.workers = max(1, int(workers))
+        # profiles every phase, see Profiler
+        self.profiler = profiler
+        # (name, seconds, error)
+        self.timings = []
+        self.started = time.monotonic()
+
+    def run(self, phases):
+        """
+        Run [(name, func)] and return their results in order
+        """
+        if self.workers == 1 or len(phases) <= 1:
+            outcomes = [self._run_one(name, func) for name, func in phases]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(phases)), thread_name_prefix="phase") as executor:
+                futures = [executor.submit(self._run_one, name, func) for name, func in phases]
+                outcomes = [x.result() for x in futures]
+
+        for _, error in outcomes:
+            if error is not None:
+                raise error
+        return [result for result, _ in outcomes]
+
+    def _run_one(self, name, func):
+        start = time.monotonic()
+        result, error = None, None
+        try:
+            with metrics.phase(name), self.profiler.phase(name) if self.profiler else nullcontext():
+                result = func()
+        except BaseException as e:
+            # including SystemExit of exit(1), so the other phases can finish first
+            error = e
+        self.timings.append((name, time.monotonic() - start, error))
+        return result, error
+
+    def log_summary(self):
+        if not self.timings:
+            return
+        total = sum(seconds for _, seconds, _ in self.timings)
+        wall = time.monotonic() - self.started
+        logger.info("Phases:")
+        for name, seconds, error in self.timings:
+            logger.info("  {:<20}{:>9.2f}s{}".format(name, seconds, "  failed" if error is not None else ""))
+        logger.info("  {:<20}{:>9.2f}s, {:.2f}s in phases".format("total", wall, total))
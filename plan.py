@@ -0,0 +1,72 @@
+import json
+import time
+
+from logger import logger
+
+# trakt allows 1 POST, PUT or DELETE per second for authenticated users
+WRITE_INTERVAL = 1.0
+
+
+class Plan:
+    """
+    Sync plan, every write request of a run in the order it would be sent, saved as json
+    to review it or to send exactly these batches later
+    """
+
+    def __init__(self, batches=None):
+        # {"collection", "action", "method", "path", "data", ...}
+        self.batches = batches or []
+        self.created_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    def add(self, collection, action, method, path, data, **extra):
+        batch = {"collection": collection, "action": action, "method": method, "path": path, "data": data}
+        batch.update(extra)
+        self.batches.append(batch)
+
+    def collections(self):
+        """
+        collection -> batches, in the order of the plan
+        """
+        result = {}
+        for batch in self.batches:
+            result.setdefault(batch["collection"], []).append(batch)
+        return result
+
+    def summary(self):
+        requests = {}
+        items = {}
+        for batch in self.batches:
+            key = f"{batch['collection']} {batch['action']}"
+            requests[key] = requests.get(key, 0) + 1
+            items[key] = items.get(key, 0) + self._count_items(batch["data"])
+        return {
+            "requests": requests,
+            "items": items,
+            "total_requests": len(self.batches),
+            "estimated_seconds": len(self.batches) * WRITE_INTERVAL,
+        }
+
+    def log_summary(self):
+        summary = self.summary()
+        for key, count in summary["requests"].items():
+            logger.info("  {:<20}{:>6} requests{:>8} items".format(key, count, summary["items"][key]))
+        logger.info("  {} requests, about {:.0f}s under the rate limit of trakt".format(summary["total_requests"], summary["estimated_seconds"]))
+
+    def save(self, file_name):
+        with open(file_name, "w", encoding="utf-8") as f:
+            json.dump({"created_at": self.created_at, "summary": self.summary(), "batches": self.batches}, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name, "r", encoding="utf-8") as f:
+            content = json.load(f)
+        plan = cls(content["batches"])
+        plan.created_at = content.get("created_at")
+        return plan
+
+    @staticmethod
+    def _count_items(data):
+        if data and all(isinstance(x, list) for x in data.values()):
+            # sync/* batches, comments are single items
+            return sum(len(x) for x in data.values())
+        return 1
@@ -0,0 +1,100 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from logger import logger
+
+
+class Profiler:
+    """
+    Profile phases with cProfile and tracemalloc, one .prof dump per phase under directory and
+    a text report of the hot functions, top allocations and peak memory of every phase.
+    Threads started during a phase, e.g. worker pools, are profiled too and merged into the phase,
+    so phases should run one after another while profiling. A phase inside another one, e.g. the
+    verification of a sync phase, pauses the profile of the outer phase until it ends.
+    """
+
+    def __init__(self, directory, top=15):
+        self.directory = directory
+        self.top = top
+        # (name, seconds, peak bytes, hot functions, top allocations)
+        self.results = []
+        self.lock = threading.Lock()
+        # [profile, peak bytes before the inner phase] of the phases running
+        self.active = []
+        os.makedirs(directory, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        thread_profiles = []
+
+        def profile_thread(*args):
+            # called once by every new thread before its first call, the profile replaces this hook
+            profile = cProfile.Profile()
+            with self.lock:
+                thread_profiles.append(profile)
+            profile.enable()
+
+        outer = self.active[-1] if self.active else None
+        if outer:
+            outer[0].disable()
+            outer[1] = max(outer[1], tracemalloc.get_traced_memory()[1])
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        previous_hook = threading.getprofile()
+        threading.setprofile(profile_thread)
+        profile = cProfile.Profile()
+        self.active.append([profile, 0])
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            seconds = time.perf_counter() - start
+            threading.setprofile(previous_hook)
+            peak = max(self.active.pop()[1], tracemalloc.get_traced_memory()[1])
+            after = tracemalloc.take_snapshot()
+
+            stats = pstats.Stats(profile)
+            with self.lock:
+                for thread_profile in thread_profiles:
+                    stats.add(thread_profile)
+            stats.dump_stats(os.path.join(self.directory, "{:02d}-{}.prof".format(len(self.results) + 1, re.sub(r"\W+", "_", name).strip("_"))))
+
+            output = io.StringIO()
+            stats.stream = output
+            stats.sort_stats("tottime").print_stats(self.top)
+            allocations = [str(x) for x in after.compare_to(before, "lineno")[: self.top]]
+            self.results.append((name, seconds, peak, self._stats_table(output.getvalue()), allocations))
+            if outer:
+                outer[0].enable()
+
+    def save_report(self):
+        file_name = os.path.join(self.directory, "report.txt")
+        with open(file_name, "w", encoding="utf-8") as f:
+            f.write("{:<24}{:>10}{:>12}\n".format("phase", "seconds", "peak MB"))
+            for name, seconds, peak, _, _ in self.results:
+                f.write("{:<24}{:>10.2f}{:>12.1f}\n".format(name, seconds, peak / 1024 / 1024))
+            for name, seconds, peak, functions, allocations in self.results:
+                f.write(f"\n== {name}: {seconds:.2f}s, peak {peak / 1024 / 1024:.1f}MB\n\nHot functions:\n{functions}\nTop allocations:\n")
+                f.writelines(f"  {x}\n" for x in allocations)
+        logger.info(f"Profiles saved to {self.directory}, report: {file_name}")
+        return file_name
+
+    @staticmethod
+    def _stats_table(text):
+        # drop the header of print_stats before the column names
+        lines = text.splitlines()
+        for index, line in enumerate(lines):
+            if line.strip().startswith("ncalls"):
+                return "\n".join(lines[index:]).rstrip() + "\n"
+        return text
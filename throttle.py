@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class TokenBucket:
+    """
+    Token bucket limiter, allows `rate` requests per second with at most `burst` requests at once.
+    backoff() slows down and pauses every caller, success() recovers the rate step by step.
+    """
+
+    def __init__(self, rate, burst=1, backoff_seconds=30, max_backoff_seconds=600):
+        self.max_rate = float(rate)
+        self.min_rate = self.max_rate / 16
+        self.rate = self.max_rate
+        self.burst = max(1, int(burst))
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def backoff(self, attempt=1):
+        """
+        Halve the rate and pause all callers, the pause doubles with every attempt
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            pause = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1))
+            self.paused_until = max(self.paused_until, now + pause)
+            self.updated = now
+            return pause
+
+    def success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def _refill(self, now):
+        # no tokens are earned while paused
+        start = max(self.updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+        self.updated = max(self.updated, now)
+
+
+class _Budget:
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        # "until" of the last period in the headers, in whole seconds
+        self.header_until = None
+        # estimated end of the period, None until a response of the period tells it
+        self.until = None
+        self.paused_until = 0.0
+
+
+class HeaderRateLimiter:
+    """
+    Rate limiter driven by the "X-Ratelimit" and "Retry-After" response headers of trakt.
+    GETs and POSTs have separate budgets, requests are sent as fast as the remaining budget
+    allows and only wait once it is used up, until the period resets.
+    """
+
+    # seconds between the checks while the end of the period is unknown
+    POLL_SECONDS = 0.1
+
+    def __init__(self):
+        self.budgets = {"GET": _Budget(), "POST": _Budget()}
+        self.lock = threading.Lock()
+        # seconds slept by all callers
+        self.slept = 0.0
+
+    def acquire(self, method):
+        """
+        Wait for budget of method, return the seconds slept
+        """
+        budget = self.budgets[self._kind(method)]
+        slept = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                if budget.until is not None and now >= budget.until:
+                    # period reset, a full budget if the limit is known, until is told by the next response
+                    budget.remaining = budget.limit
+                    budget.until = None
+
+                if now < budget.paused_until:
+                    wait = budget.paused_until - now
+                elif budget.remaining is not None and budget.remaining <= 0:
+                    # until is unknown while the first responses of the period are pending
+                    wait = budget.until - now if budget.until is not None else self.POLL_SECONDS
+                else:
+                    if budget.remaining is not None:
+                        budget.remaining -= 1
+                    self.slept += slept
+                    return slept
+            time.sleep(wait)
+            slept += wait
+
+    def update(self, method, response):
+        budget = self.budgets[self._kind(method)]
+        with self.lock:
+            rate_limit = self._parse_rate_limit(response.headers.get("X-Ratelimit"))
+            if rate_limit and isinstance(rate_limit.get("remaining"), int):
+                self._update_budget(budget, rate_limit)
+
+            if response.status_code == 429:
+                try:
+                    retry_after = float(response.headers.get("Retry-After"))
+                except (TypeError, ValueError):
+                    # no hint, wait a moment before the request is sent again
+                    retry_after = 1.0
+                budget.paused_until = max(budget.paused_until, time.time() + retry_after)
+
+    @staticmethod
+    def _update_budget(budget, rate_limit):
+        header_until = HeaderRateLimiter._parse_time(rate_limit.get("until"))
+        if budget.header_until is not None and (header_until < budget.header_until or header_until == budget.header_until and budget.until is None):
+            # a late response of the last period
+            return
+        same_period = header_until == budget.header_until
+        remaining = rate_limit["remaining"]
+        if budget.remaining is not None and (same_period or budget.until is None):
+            # responses of concurrent requests arrive in any order, the lowest count of the period is the latest
+            remaining = min(budget.remaining, remaining)
+
+        # "until" is cut to whole seconds, the period ends within the second after it. The period starts with
+        # its first request, so it ends no later than a period after the response of that request
+        until = header_until + 1
+        limit, period = rate_limit.get("limit"), rate_limit.get("period")
+        if isinstance(limit, int) and isinstance(period, (int, float)) and rate_limit["remaining"] == limit - 1:
+            until = max(header_until, min(until, time.time() + period))
+        if same_period and budget.until is not None:
+            until = min(budget.until, until)
+
+        budget.remaining = remaining
+        budget.header_until = header_until
+        budget.until = until
+        budget.limit = limit if isinstance(limit, int) else budget.limit
+
+    @staticmethod
+    def _kind(method):
+        return "GET" if method.upper() in ["GET", "HEAD"] else "POST"
+
+    @staticmethod
+    def _parse_rate_limit(header):
+        if not header:
+            return None
+        try:
+            return json.loads(header)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _parse_time(value):
+        """
+        time format: "2020-10-10T00:24:00Z"
+        """
+        try:
+            return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            return 0.0